@@ -0,0 +1,52 @@
+import sys
+import time
+import argparse
+import tracemalloc
+from spotflow.api import SpotFlow
+
+# Peak memory (tracemalloc) of monitoring long loops with all var states, which create a state per local
+# per run line. Run from the root of the repo: python -m lab.memory_benchmark
+
+
+def loop(n):
+    total = 0
+    for i in range(n):
+        total += i % 7
+        name = 'x' if i % 2 else 'y'
+    return total
+
+
+def run(calls, iterations):
+    flow = SpotFlow()
+    flow.target_methods([f'{loop.__module__}.loop'])
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    flow.start()
+    for _ in range(calls):
+        loop(iterations)
+    flow.stop()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return flow.result(), current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory benchmark of SpotFlow')
+    parser.add_argument('--calls', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    monitored_program, current, peak, elapsed = run(args.calls, args.iterations)
+    print(f'Python {sys.version.split()[0]}, {args.calls} calls of {args.iterations} iterations')
+    print(f'peak: {peak / 2 ** 20:.1f} MiB, result: {current / 2 ** 20:.1f} MiB, time: {elapsed:.1f} s')
+
+    # Equal values of the states are shared through the value pool of the program
+    states = sum(len(var.states) for call in monitored_program.all_calls()
+                 for var in call.call_state.var_states.values())
+    print(f'var states: {states}, distinct values: {len(monitored_program.value_pool)}')
+
+
+if __name__ == '__main__':
+    main()
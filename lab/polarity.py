@@ -98,12 +98,12 @@ def branch_data_for_program(monitored_program):
 
 def branch_data_for_call(method_call, branch_data):
 
-    executable_lines = method_call.monitored_method.info.executable_lines()
+    method_info = method_call.monitored_method.info
 
-    for control_flow_lineno in sorted(method_call.monitored_method.info.control_flow_lines):
-        key = method_call.monitored_method.info.filename, control_flow_lineno
-        if control_flow_lineno in executable_lines:
-            control_flow_value = check_control_flow(method_call, control_flow_lineno, executable_lines)
+    for control_flow_lineno in sorted(method_info.control_flow_lines):
+        key = method_info.filename, control_flow_lineno
+        if method_info._line_is_executable(control_flow_lineno):
+            control_flow_value = check_control_flow(method_call, control_flow_lineno, method_info)
             if control_flow_value is not None:
                 branch_data[key] = branch_data.get(key, [])
                 branch_data[key].append(control_flow_value)
@@ -112,13 +112,13 @@ def branch_data_for_call(method_call, branch_data):
 def check_branch(method_call, branch_data, min_branch_frequency):
 
     result = []
-    executable_lines = method_call.monitored_method.info.executable_lines()
+    method_info = method_call.monitored_method.info
 
-    for control_flow_lineno in sorted(method_call.monitored_method.info.control_flow_lines):
-        if control_flow_lineno in executable_lines:
-            control_flow_value = check_control_flow(method_call, control_flow_lineno, executable_lines)
+    for control_flow_lineno in sorted(method_info.control_flow_lines):
+        if method_info._line_is_executable(control_flow_lineno):
+            control_flow_value = check_control_flow(method_call, control_flow_lineno, method_info)
             if control_flow_value is not None:
-                key = method_call.monitored_method.info.filename, control_flow_lineno
+                key = method_info.filename, control_flow_lineno
                 t, f, branch_frequency, branch_prevalence = branch_data[key]
                 if branch_frequency >= min_branch_frequency:
                     if control_flow_value == branch_prevalence:
@@ -128,20 +128,12 @@ def check_branch(method_call, branch_data, min_branch_frequency):
     return result
 
 
-def check_control_flow(method_call, control_flow_lineno, executable_lines):
+def check_control_flow(method_call, control_flow_lineno, method_info):
 
-    next_control_flow_line = find_next_executable_line(control_flow_lineno, executable_lines)
+    next_control_flow_line = method_info._next_executable_line(control_flow_lineno)
     if not next_control_flow_line:
         return None
 
     if control_flow_lineno in method_call.run_lines and next_control_flow_line in method_call.run_lines:
         return True
     return False
-
-
-def find_next_executable_line(lineno, executable_lines):
-    try:
-        index = executable_lines.index(lineno)
-        return executable_lines[index + 1]
-    except Exception:
-        return None
\ No newline at end of file
@@ -1,5 +1,15 @@
+import os
+import asyncio
+import inspect
 from spotflow.report import Report
 from spotflow.collector import Collector
+from spotflow.eventlog import read_event_log
+from spotflow.ringbuffer import DEFAULT_CAPACITY, BLOCK
+from spotflow.model import MAX_FLOWS
+from spotflow.static_analysis import DEFAULT_CACHE_DIR, AnalysisCache, use_analysis_cache, using_analysis_cache
+from spotflow.multiproc import DEFAULT_SHARDS_DIR, start_parallel, stop_parallel, load_shards
+from spotflow.render import DEFAULT_MAX_ITEMS, DEFAULT_MAX_DEPTH, DEFAULT_MAX_STRING, \
+    DEFAULT_MAX_LENGTH
 from spotflow.utils_unittest import loadTestsFromModule, loadTestsFromTestCase, suite_runner
 
 
@@ -7,6 +17,10 @@ class SpotFlow:
 
     def __init__(self):
         self.collector = Collector()
+        self.shards_dir = None
+        # Only used while this flow monitors, combines or reports (see analysis_cache)
+        self.cache = None
+        self.previous_cache = None
 
     def target_methods(self, method_names):
         self.collector.method_names = method_names
@@ -17,39 +31,120 @@ class SpotFlow:
     def ignore_files(self, ignore_files):
         self.collector.ignore_files = ignore_files
 
+    def tracer(self, tracer):
+        # 'settrace' (default), 'monitoring', which requires Python 3.12+,
+        # or 'setprofile', which only collects calls and their states
+        self.collector.tracer = tracer
+
     def collect_states(self, arg_states=True, return_states=True, yield_states=True,
-                       exception_states=True, var_states=True):
+                       exception_states=True, var_states=True,
+                       max_items=DEFAULT_MAX_ITEMS, max_depth=DEFAULT_MAX_DEPTH, max_string=DEFAULT_MAX_STRING,
+                       max_length=DEFAULT_MAX_LENGTH, time_budget=None):
+        # var_states='changes' only reads the locals that may have changed since the previous line,
+        # which is much faster in long-running methods and gives the same distinct states.
+        # Values are rendered up to max_items items per container, max_depth nested containers,
+        # max_string characters per string and max_length characters (or time_budget seconds) per value
 
         self.collector.collect_arg_states = arg_states
         self.collector.collect_return_states = return_states
         self.collector.collect_yield_states = yield_states
         self.collector.collect_exception_states = exception_states
         self.collector.collect_var_states = var_states
+        self.collector.value_renderer.set_limits(max_items, max_depth, max_string, max_length, time_budget)
+
+    def max_flows(self, max_flows=MAX_FLOWS):
+        # Flows kept per method, most common first (None or 0 keeps all). The calls of the other flows
+        # are in the other_calls of the method
+        self.collector.max_flows = max_flows
+
+    def record(self, path):
+        # Instead of building the result while monitoring, only the events are written to a binary file at path,
+        # so that the monitored program does less work. The result is then rebuilt with rebuild(path).
+        self.collector.record_path = path
+
+    def rebuild(self, path):
+        with using_analysis_cache(self.cache):
+            self.collector.combine([read_event_log(path)])
+
+    def buffered(self, capacity=DEFAULT_CAPACITY, overflow=BLOCK):
+        # The monitored threads only push the events into a ring buffer of capacity events, and a background
+        # thread renders the values and saves the states. When the buffer is full, the monitored threads
+        # wait ('block'), the events are skipped and counted in dropped_events() ('drop'),
+        # or their values are rendered and written to a temporary file ('spill')
+        self.collector.buffer_capacity = capacity
+        self.collector.buffer_overflow = overflow
+
+    def dropped_events(self):
+        return self.collector.dropped_events
+
+    def analysis_cache(self, directory=DEFAULT_CACHE_DIR):
+        # The static analysis of the monitored files (lines, definitions, highlighted code) is saved in directory
+        # and reused by later runs (and child processes) while the files are unchanged. None turns it off
+        self.cache = AnalysisCache(os.path.abspath(directory)) if directory else None
+
+    def register_formatter(self, type_, formatter):
+        # formatter(obj) -> str renders the states of values of exactly this type
+        self.collector.value_renderer.register_formatter(type_, formatter)
+
+    def parallel(self, shards_dir=DEFAULT_SHARDS_DIR):
+        # Child processes (multiprocessing, concurrent.futures and python subprocesses) are monitored too.
+        # Each child saves its result as a shard in shards_dir, which is merged into the result on stop
+        self.shards_dir = os.path.abspath(shards_dir)
+
+    def run_async(self, coro):
+        # Runs coro in a new event loop, whose tasks continue the call stacks of the coroutines that created them
+        loop = asyncio.new_event_loop()
+        loop.set_task_factory(self.collector.create_task)
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            try:
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                loop.close()
 
     def start(self):
+        self.previous_cache = use_analysis_cache(self.cache)
+        if self.shards_dir:
+            start_parallel(self.collector, self.shards_dir)
         self.collector.start()
 
     def stop(self):
-        self.collector.stop()
+        try:
+            if not self.shards_dir:
+                self.collector.stop()
+                return
+            stop_parallel()
+            self.collector.stop(load_shards(self.shards_dir))
+        finally:
+            use_analysis_cache(self.previous_cache)
+
+    def combine(self, shards_dir=DEFAULT_SHARDS_DIR):
+        # Merges the shards of children that exited after stop (or of other runs) into the result
+        with using_analysis_cache(self.cache):
+            self.collector.combine(load_shards(os.path.abspath(shards_dir)))
 
     def result(self):
         return self.collector.monitored_program
 
     def html_report(self, directory=None):
         try:
-            Report(self.result()).html_report(directory)
+            with using_analysis_cache(self.cache):
+                Report(self.result()).html_report(directory)
         except Exception as e:
             print(e)
 
     def csv_report(self, directory=None):
         try:
-            Report(self.result()).csv_report(directory)
+            with using_analysis_cache(self.cache):
+                Report(self.result()).csv_report(directory)
         except Exception as e:
             print(e)
 
     def pprint_report(self):
         try:
-            Report(self.collector.monitored_program).pprint_report()
+            with using_analysis_cache(self.cache):
+                Report(self.collector.monitored_program).pprint_report()
             return True
         except Exception as e:
             print(e)
@@ -82,6 +177,27 @@ def monitor(func, target_methods=None, target_files=None, ignore_files=None,
     return flow.result()
 
 
+def monitor_async(coro, target_methods=None, target_files=None, ignore_files=None,
+                  arg_states=True, return_states=True, yield_states=True, exception_states=True, var_states=True):
+    # coro is a coroutine or an async function without arguments
+    if inspect.iscoroutinefunction(coro):
+        coro = coro()
+
+    flow = SpotFlow()
+    flow.target_methods(target_methods)
+    flow.target_files(target_files)
+    flow.ignore_files(ignore_files)
+    flow.collect_states(arg_states, return_states, yield_states, exception_states, var_states)
+
+    flow.start()
+    try:
+        flow.run_async(coro)
+    finally:
+        flow.stop()
+
+    return flow.result()
+
+
 def monitor_unittest_module(module, target_methods=None, target_files=None, ignore_files=None,
             arg_states=True, return_states=True, yield_states=True, exception_states=True, var_states=True):
 
@@ -0,0 +1,26 @@
+# Added to the PYTHONPATH of child processes when monitoring in parallel mode, so that python subprocesses
+# start a collector. Then, the sitecustomize module shadowed by this one (if any) is run.
+import os
+import sys
+
+bootstrap_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path[:] = [path for path in sys.path if os.path.abspath(path or '.') != bootstrap_dir]
+
+if os.environ.get('SPOTFLOW_PROCESS_START'):
+    try:
+        import spotflow
+    except ImportError:
+        # Eg, spotflow is run from a checkout: it is found last, so that it does not shadow the packages of the child
+        sys.path.append(os.path.dirname(os.path.dirname(bootstrap_dir)))
+    try:
+        from spotflow.multiproc import start_child
+        start_child()
+    except ImportError:
+        pass
+
+this_module = sys.modules.pop('sitecustomize', None)
+try:
+    import sitecustomize
+except ImportError:
+    # The import of this module expects to find it in sys.modules when there is no other sitecustomize
+    sys.modules['sitecustomize'] = this_module
@@ -2,6 +2,11 @@ import argparse
 import configparser
 import importlib.util
 from spotflow.api import SpotFlow
+from spotflow.multiproc import DEFAULT_SHARDS_DIR
+from spotflow.model import MAX_FLOWS
+from spotflow.ringbuffer import DEFAULT_CAPACITY, OVERFLOWS, BLOCK
+from spotflow.static_analysis import DEFAULT_CACHE_DIR
+from spotflow.render import DEFAULT_MAX_ITEMS, DEFAULT_MAX_DEPTH, DEFAULT_MAX_STRING, DEFAULT_MAX_LENGTH
 from coverage.cmdline import PyRunner
 
 OK, ERR = 0, 1
@@ -16,17 +21,82 @@ parser.add_argument('-a', '--action', type=str,
 parser.add_argument('-t', '--target-method', type=str, action='append',
                     help='Target method full name (in the format module.Class.method) or prefix. '
                          'For example, "parser.StringParser.count" or simply "parse". '
+                         'Use the prefix "re:" for a regular expression or "glob:" for shell-style wildcards. '
                          'To monitor multiple methods, use multiple arguments, like -t name1 -t name2 -t ...')
 
 parser.add_argument('-f', '--target-file', type=str, action='append',
                     help='Target file. It can be a substring of the file full path. '
                          'For example, "path/to/my_program.py" or simply "my_program". '
+                         'Use the prefix "re:" for a regular expression or "glob:" for shell-style wildcards. '
                          'To monitor multiple files, use multiple arguments, like -f file1 -f file2 -f ...')
 
 parser.add_argument('-i', '--ignore-file', type=str, action='append',
                     help='File to ignore. It can be a substring of the file full path. '
                          'To ignore multiple files, use multiple arguments, like -i file1 -i file2 -i ...')
 
+parser.add_argument('--tracer', type=str, default='settrace', choices=['settrace', 'monitoring', 'setprofile'],
+                    help='Tracer used to monitor the program. '
+                         '"monitoring" uses sys.monitoring (Python 3.12+) and only traces target methods. '
+                         '"setprofile" only collects calls and their states (no run lines, var states or flows), '
+                         'which is much faster. Default is "settrace".')
+
+parser.add_argument('--max-items', type=int, default=DEFAULT_MAX_ITEMS,
+                    help='Maximum number of items rendered for lists, tuples, sets and dicts. '
+                         f'Default is {DEFAULT_MAX_ITEMS}.')
+
+parser.add_argument('--max-depth', type=int, default=DEFAULT_MAX_DEPTH,
+                    help=f'Maximum depth rendered for nested containers. Default is {DEFAULT_MAX_DEPTH}.')
+
+parser.add_argument('--max-string', type=int, default=DEFAULT_MAX_STRING,
+                    help=f'Maximum number of characters rendered for strings. Default is {DEFAULT_MAX_STRING}.')
+
+parser.add_argument('--max-length', type=int, default=DEFAULT_MAX_LENGTH,
+                    help=f'Maximum number of characters rendered for a value. Default is {DEFAULT_MAX_LENGTH}.')
+
+parser.add_argument('--time-budget', type=float,
+                    help='Maximum time, in seconds, to render a value. By default, there is no time limit.')
+
+parser.add_argument('--max-flows', type=int, default=MAX_FLOWS,
+                    help='Maximum number of flows (distinct sets of run lines) per method, most common first. '
+                         f'Use 0 to keep all flows. Default is {MAX_FLOWS}.')
+
+parser.add_argument('--parallel', action='store_true',
+                    help='Also monitor child processes started with multiprocessing, concurrent.futures or python '
+                         'subprocesses. Each child saves its result in the shards dir, which is merged on exit.')
+
+parser.add_argument('--combine', action='store_true',
+                    help='Instead of running a program, combine the results saved in the shards dir '
+                         '(eg, by child processes that exited after the parent).')
+
+parser.add_argument('--shards-dir', type=str, default=DEFAULT_SHARDS_DIR,
+                    help=f'Directory of the results of child processes. Default is "{DEFAULT_SHARDS_DIR}".')
+
+parser.add_argument('--record', type=str, metavar='FILE',
+                    help='Instead of building the result while monitoring, write the events to a binary FILE, '
+                         'which is much cheaper. The result is then rebuilt with --rebuild FILE.')
+
+parser.add_argument('--rebuild', type=str, metavar='FILE',
+                    help='Instead of running a program, rebuild the result from the events recorded in FILE.')
+
+parser.add_argument('--buffered', action='store_true',
+                    help='Render the values and save the states in a background thread, which takes the events '
+                         'of the monitored threads from a ring buffer.')
+
+parser.add_argument('--buffer-size', type=int, default=DEFAULT_CAPACITY,
+                    help=f'Number of events in the ring buffer of --buffered. Default is {DEFAULT_CAPACITY}.')
+
+parser.add_argument('--overflow', type=str, default=BLOCK, choices=OVERFLOWS,
+                    help='What to do when the ring buffer is full: "block" waits for the background thread, '
+                         '"drop" skips the events and "spill" writes them to a temporary file. '
+                         f'Default is "{BLOCK}".')
+
+parser.add_argument('--analysis-cache', action='store_true',
+                    help='Save the static analysis of the monitored files in the cache dir and reuse it in later '
+                         'runs, while the files are unchanged.')
+
+parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                    help=f'Directory of the analysis cache. Default is "{DEFAULT_CACHE_DIR}".')
+
 parser.add_argument('-d', '--dir', type=str, help='Write the output files to dir.')
 
 parser.add_argument('run',  type=str, nargs=argparse.REMAINDER,
@@ -43,9 +113,41 @@ class SpotFlowScript:
         self.target_files = args.target_file
         self.ignore_files = args.ignore_file
         self.directory = args.dir
+        self.tracer = args.tracer
+        self.value_limits = dict(max_items=args.max_items, max_depth=args.max_depth, max_string=args.max_string,
+                                 max_length=args.max_length, time_budget=args.time_budget)
+        self.max_flows = args.max_flows or None
+        self.parallel = args.parallel
+        self.combine = args.combine
+        self.shards_dir = args.shards_dir
+        self.record = args.record
+        self.rebuild = args.rebuild
+        self.buffer_size = args.buffer_size if args.buffered else None
+        self.overflow = args.overflow
+        self.cache_dir = args.cache_dir if args.analysis_cache else None
         self.run_args = args.run
 
     def command_line(self):
+        if self.combine:
+            print(f'Combining the results in: {self.shards_dir}')
+            flow = SpotFlow()
+            flow.max_flows(self.max_flows)
+            if self.cache_dir:
+                flow.analysis_cache(self.cache_dir)
+            flow.combine(self.shards_dir)
+            self.handle_action(flow)
+            return OK
+
+        if self.rebuild:
+            print(f'Rebuilding the result from: {self.rebuild}')
+            flow = SpotFlow()
+            flow.max_flows(self.max_flows)
+            if self.cache_dir:
+                flow.analysis_cache(self.cache_dir)
+            flow.rebuild(self.rebuild)
+            self.handle_action(flow)
+            return OK
+
         if not self.run_args:
             print('Nothing to run...')
             return OK
@@ -59,6 +161,17 @@ class SpotFlowScript:
         flow.target_methods(self.target_methods)
         flow.target_files(self.target_files)
         flow.ignore_files(self.ignore_files)
+        flow.tracer(self.tracer)
+        flow.collect_states(**self.value_limits)
+        flow.max_flows(self.max_flows)
+        if self.cache_dir:
+            flow.analysis_cache(self.cache_dir)
+        if self.parallel:
+            flow.parallel(self.shards_dir)
+        if self.record:
+            flow.record(self.record)
+        if self.buffer_size:
+            flow.buffered(self.buffer_size, self.overflow)
         # states = self.handle_config()
         # if states:
         #     flow.collect_states(*states)
@@ -75,8 +188,13 @@ class SpotFlowScript:
             code_ran = False
         finally:
             flow.stop()
+            if flow.dropped_events():
+                print(f'Dropped events (the buffer was full): {flow.dropped_events()}')
             if code_ran:
-                self.handle_action(flow)
+                if self.record:
+                    print(f'Events recorded in: {self.record}')
+                else:
+                    self.handle_action(flow)
                 return OK
             return ERR
 
@@ -1,8 +1,31 @@
+import sys
+import dis
+import asyncio
 import inspect
-from spotflow.utils import obj_value, obj_type, find_full_name, is_method_or_func
-from spotflow.model import CallState, MonitoredMethod, MonitoredProgram
+import weakref
+from threading import get_ident
+from spotflow.utils import obj_value, obj_type, find_full_name, is_method_or_func, may_change_in_place, \
+    IMMUTABLE_TYPES
+from spotflow.model import CallState, MonitoredMethod, MonitoredProgram, MAX_FLOWS
 from spotflow.info import MethodInfo
-from spotflow.tracer import PyTracer
+from spotflow.static_analysis import analysis_for_frame, store_lines
+from spotflow.matcher import TargetMatcher
+from spotflow.render import ValueRenderer
+from spotflow.eventlog import EventLog
+from spotflow.ringbuffer import RingBuffer, Rendered, BLOCK
+from spotflow.tracer import PyTracer, MonitoringTracer, ProfileTracer
+
+RESUME = dis.opmap.get('RESUME')
+YIELD_VALUE = dis.opmap.get('YIELD_VALUE')
+YIELD_FROM = dis.opmap.get('YIELD_FROM')
+RETURN_OPCODES = {dis.opmap[name] for name in ('RETURN_VALUE', 'RETURN_CONST') if name in dis.opmap}
+GENERATOR_FLAGS = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+
+# Value of collect_var_states to only save the var states that may have changed
+VAR_STATES_CHANGES = 'changes'
+
+# Kinds of the states whose values are rendered and saved by save_states, possibly in the consumer thread
+ARG, VAR, CHANGED_VAR, RETURN, YIELD = range(5)
 
 
 def get_next_mro_class(current_class):
@@ -11,51 +34,285 @@ def get_next_mro_class(current_class):
     return mro_classes[current_class_index+1]
 
 
-def get_frame_id(frame):
-    # If we are dealing with comprehensions and generator expressions
-    # then we should get the enclosing frame id, not the current one.
-    # This is done to avoid novel flows being created to listcomp and genexpr...
-    if is_comprehension(frame):
-        return id(frame.f_back)
-    return id(frame)
+def is_new_call(frame):
+    # Tip from Coverage.py
+    # The call event is really a "start frame" event, and happens for
+    # function calls and re-entering generators.  The f_lasti field is
+    # -1 for calls, and a real offset for generators.  Use < 0 as the
+    # line number for calls, and the real line number for generators.
+    # Since Python 3.11, frames start at a RESUME instruction, whose argument
+    # is 0 for calls and non-zero when re-entering generators. Generators
+    # re-entered by throw() or close() do not start at a RESUME.
+    if RESUME is not None:
+        code = frame.f_code.co_code
+        return code[frame.f_lasti] == RESUME and (code[frame.f_lasti + 1] & 3) == 0
+    return getattr(frame, 'f_lasti', -1) < 0
+
+
+def active_state(frame, active_frames):
+    # The state of a finished frame whose id is reused by another frame is dropped
+    frame_state = active_frames.get(id(frame))
+    if frame_state is not None and frame_state.code is not frame.f_code:
+        del active_frames[id(frame)]
+        return None
+    return frame_state
+
+
+def is_suspended(frame):
+    # Generators and coroutines also have return events when they yield or await. Suspended frames stop
+    # at a YIELD_VALUE, before a YIELD_FROM (up to Python 3.10) or at the RESUME after a yield (Python 3.13+)
+    if not frame.f_code.co_flags & GENERATOR_FLAGS:
+        return False
+    code = frame.f_code.co_code
+    opcode = code[frame.f_lasti]
+    if opcode == YIELD_VALUE:
+        return True
+    if opcode == RESUME:
+        return (code[frame.f_lasti + 1] & 3) != 0
+    next_lasti = frame.f_lasti + 2
+    return YIELD_FROM is not None and next_lasti < len(code) and code[next_lasti] == YIELD_FROM
+
+
+def is_unwinding(frame):
+    # Return events of frames unwound by an exception stop at the instruction that raised
+    if frame.f_lasti < 0:
+        return False
+    return frame.f_code.co_code[frame.f_lasti] not in RETURN_OPCODES and not is_suspended(frame)
+
+
+def resolve_exception(frame, name):
+    names = name.split('.')
+    for namespace in (frame.f_locals, frame.f_globals, frame.f_builtins):
+        if names[0] in namespace:
+            entity = namespace[names[0]]
+            break
+    else:
+        return None
+    try:
+        for each in names[1:]:
+            entity = getattr(entity, each)
+    except Exception:
+        return None
+    if isinstance(entity, BaseException):
+        return type(entity)
+    if isinstance(entity, type) and issubclass(entity, BaseException):
+        return entity
+    return None
 
 
 def is_comprehension(frame):
     return frame.f_code.co_name in ['<listcomp>', '<setcomp>', '<dictcomp>', '<genexpr>']
 
 
+def is_closing_comprehension(frame, arg):
+    # Comprehensions belong to their enclosing method, but closing a
+    # pending generator expression is not an exception of that method
+    return is_comprehension(frame) and arg[0] is GeneratorExit
+
+
+def arg_values(frame):
+    argvalues = inspect.getargvalues(frame)
+    names = list(argvalues.args)
+    if argvalues.varargs:
+        names.append(argvalues.varargs)
+    if argvalues.keywords:
+        names.append(argvalues.keywords)
+    return {name: argvalues.locals[name] for name in names}
+
+
+def is_asyncio_frame(frame):
+    return frame.f_globals.get('__name__', '').startswith('asyncio.')
+
+
+def find_func_by_qualname(frame):
+    # Since Python 3.11, code objects have a qualified name, which is enough to find
+    # module functions, methods, class methods and static methods without looking at locals
+    qualname = getattr(frame.f_code, 'co_qualname', None)
+    if not qualname or '<' in qualname:
+        return None
+    try:
+        names = qualname.split('.')
+        entity = frame.f_globals[names[0]]
+        for name in names[1:]:
+            entity = getattr(entity, name)
+        return entity
+    except Exception:
+        return None
+
+
+def find_func_with_code(func_or_method, code):
+    # The function or method must be the one running the code, possibly wrapped by decorators
+    while is_method_or_func(func_or_method) and not inspect.isbuiltin(func_or_method):
+        if get_func_code(func_or_method) is code:
+            return func_or_method
+        func_or_method = getattr(func_or_method, '__wrapped__', None)
+    return None
+
+
+def get_func_code(func_or_method):
+    func = getattr(func_or_method, '__func__', func_or_method)
+    return getattr(func, '__code__', None)
+
+
 def method_has_super_call(frame):
-    return '__class__' in frame.f_locals and 'super' in frame.f_code.co_names
+    # Methods calling super() have the __class__ cell as a free variable
+    return '__class__' in frame.f_code.co_freevars and 'super' in frame.f_code.co_names
+
+
+class ShadowStack:
+
+    # Call stacks of the active frames, so that the call stack of a new call is its parent's plus
+    # its own name, instead of walking f_back up to the test and resolving the name of every frame on
+    # every call. Copying the parent's stack still takes O(depth), but names are only resolved for new
+    # frames. A call stack goes from the closest test frame (or the last frame that is a function or
+    # method) to the current frame. Frames are pushed when their call stack is first needed and popped
+    # when they return, or lazily when a new frame does not descend from them (untraced frames have no
+    # return events). Entries keep the ids and codes of their frames, not the frames, so that the locals
+    # of finished callers are freed (and their finalizers run) as usual.
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.ids = []
+        self.codes = []
+        self.stacks = []
+        self.indexes = {}
+
+    def call_stack(self, frame):
+        name = frame.f_code.co_name
+        if 'test_' in name or not frame.f_back:
+            return (name,)
+        task_stack = self.collector.task_call_stack(frame)
+        if task_stack is not None:
+            return task_stack + (name,)
+        return self.frame_stack(frame.f_back) + (name,)
+
+    def frame_stack(self, frame):
+        new_frames = []
+        while True:
+            index = self.index_of(frame)
+            if index is not None:
+                self.truncate(index + 1)
+                break
+
+            full_name = self.collector.get_full_entity_name(frame)
+            if not full_name:
+                # Frames that are not functions or methods end the call stack
+                self.truncate(0)
+                self.push(frame, ())
+                break
+
+            if 'test_' in frame.f_code.co_name or not frame.f_back:
+                self.truncate(0)
+                self.push(frame, (full_name,))
+                break
+
+            # Tasks are run by the event loop, so their coroutines continue the call stack of their creator
+            task_stack = self.collector.task_call_stack(frame)
+            if task_stack is not None:
+                self.truncate(0)
+                self.push(frame, task_stack + (full_name,), task=True)
+                break
+
+            new_frames.append((frame, full_name))
+            frame = frame.f_back
+
+        for frame, full_name in reversed(new_frames):
+            self.push(frame, self.stacks[-1] + (full_name,))
+        return self.stacks[-1]
+
+    def index_of(self, frame):
+        index = self.indexes.get(id(frame))
+        if index is None:
+            return None
+        # Ids of finished frames may be reused by new frames, and generators may be resumed from other
+        # frames, so the entry is only valid if it and its parent are still the ones of the frame and its
+        # caller. Older ancestors are not walked: entries of finished frames are popped when they return, or
+        # truncated when a new frame does not descend from them
+        if not self.is_entry_of(index, frame):
+            self.truncate(index)
+            return None
+        if index > 0 and not self.is_entry_of(index - 1, frame.f_back):
+            self.truncate(index - 1)
+            return None
+        return index
+
+    def is_entry_of(self, position, frame):
+        return frame is not None and id(frame) == self.ids[position] and self.has_code(position, frame)
+
+    def has_code(self, position, frame):
+        code = self.codes[position]
+        if code is None:
+            # The coroutine of a task, whose call stack is the one of the task
+            return self.collector.task_call_stack(frame) == self.stacks[position][:-1]
+        return code is frame.f_code
+
+    def push(self, frame, call_stack, task=False):
+        self.indexes[id(frame)] = len(self.ids)
+        self.ids.append(id(frame))
+        self.codes.append(None if task else frame.f_code)
+        self.stacks.append(call_stack)
+
+    def pop(self, frame):
+        if self.ids and self.ids[-1] == id(frame):
+            self.truncate(len(self.ids) - 1)
+
+    def truncate(self, size):
+        for frame_id in self.ids[size:]:
+            del self.indexes[frame_id]
+        del self.ids[size:]
+        del self.codes[size:]
+        del self.stacks[size:]
 
+    def clear(self):
+        self.truncate(0)
 
-def line_has_return(frame):
-    return line_has_keyword(frame, 'return')
 
+class FrameState:
 
-def line_has_yield(frame):
-    return line_has_keyword(frame, 'yield')
+    # State of an active frame of a target method, dropped when the frame finishes: its method call
+    # (comprehensions share the call of their enclosing method) and the last line it ran.
+    # Generators closed while suspended may finish without events (eg, always in Python 3.13+), so states
+    # keep the code of their frame: a state is only used by a frame with the id and code of its own, and new
+    # frames (which start with a call event) replace it.
+    # Change-driven var states take a first snapshot of all locals, then only read the locals the
+    # last line may rebind (STORE_FAST and friends), plus the ones bound to values that may change
+    # in place without being rebound (anything but immutable scalars).
 
+    __slots__ = ('code', 'method_call', 'last_line', 'raised', 'mutable_vars')
 
-def line_has_control_flow(frame):
-    return line_has_keywords(frame, ['if', 'elif', 'while', 'for'])
+    def __init__(self, code, method_call, last_line=-1):
+        self.code = code
+        self.method_call = method_call
+        self.last_line = last_line
+        self.raised = False
+        self.mutable_vars = None
 
+    def names_to_read(self, code):
+        names = store_lines(code).get(self.last_line, ())
+        if self.mutable_vars:
+            names = names + tuple(name for name in self.mutable_vars if name not in names)
+        return names
 
-def line_has_keyword(frame, keyword):
-    traceback = inspect.getframeinfo(frame)
-    if traceback.code_context and len(traceback.code_context) >= 1:
-        code_line = traceback.code_context[0].strip()
-        return code_line.startswith(keyword)
-    return False
+    def is_finished(self, frame):
+        # Frames finish with a return or when an exception unwinds them (exception then return)
+        return self.raised or not is_suspended(frame)
 
 
-def line_has_keywords(frame, keywords):
-    traceback = inspect.getframeinfo(frame)
-    if traceback.code_context and len(traceback.code_context) >= 1:
-        code_line = traceback.code_context[0].strip()
-        for keyword in keywords:
-            if code_line.startswith(keyword):
-                return True
-    return False
+class ThreadState:
+
+    # Data collected in a thread: its call stacks, active frames and calls, which are buffered in a program of
+    # its own, so that threads do not contend for (or mix up) the same stacks. Programs are merged on stop.
+
+    __slots__ = ('monitored_program', 'shadow_stack', 'active_frames')
+
+    def __init__(self, collector):
+        self.monitored_program = MonitoredProgram()
+        self.shadow_stack = ShadowStack(collector)
+        self.active_frames = {}
+
+    def clear(self):
+        self.shadow_stack.clear()
+        self.active_frames.clear()
 
 
 class Collector:
@@ -72,71 +329,172 @@ class Collector:
         self.collect_yield_states = True
         self.collect_exception_states = True
         self.collect_var_states = True
+        self.value_renderer = ValueRenderer()
+        self.max_flows = MAX_FLOWS
+        # With a record path, events are written to an event log instead of the monitored program
+        self.record_path = None
+        self.event_log = None
+        # With a buffer capacity, values are rendered and states saved by a background thread, which takes
+        # the events from a ring buffer. buffer_overflow is 'block', 'drop' or 'spill' (see RingBuffer)
+        self.buffer_capacity = None
+        self.buffer_overflow = BLOCK
+        self.event_buffer = None
+        self.dropped_events = 0
+        self.dispatch = self.save_states
+        # Idents of the threads the tracers do not monitor, eg, the consumer of the buffer
+        self.ignored_threads = frozenset()
 
-        self.last_frame_lineno = {}
         self.target_methods_cache = {}
-        self.frame_cache = {}
         self.funcs_cache = {}
+        self.init_target()
 
+        self.thread_states = {}
+        self.task_call_stacks = weakref.WeakKeyDictionary()
+
+        self.tracer = 'settrace'
         self.py_tracer = PyTracer(self)
 
     def start(self):
         self.init_target()
+        # The calls of the thread that starts monitoring come first
+        self.thread_states = {}
+        self.thread_state()
+        if self.record_path:
+            self.event_log = EventLog(self.record_path)
+        self.dispatch = self.save_states
+        if self.buffer_capacity:
+            # The consumer starts before the tracer, so that it is not traced
+            self.event_buffer = RingBuffer(self.save_states, self.buffer_capacity, self.buffer_overflow,
+                                           self.render_values)
+            self.event_buffer.start()
+            self.dispatch = self.push_event
+            self.ignored_threads = frozenset([self.event_buffer.thread.ident])
+        self.py_tracer = self.build_tracer()
         self.py_tracer.start_tracer()
 
-    def stop(self):
+    def stop(self, programs=()):
         self.py_tracer.stop_tracer()
-        self.monitored_program._update_flows_and_info()
+        if self.event_buffer:
+            self.event_buffer.close()
+            self.dropped_events = self.event_buffer.dropped
+            self.event_buffer = None
+            self.dispatch = self.save_states
+            self.ignored_threads = frozenset()
+        if self.event_log:
+            self.event_log.close()
+            self.event_log = None
+        for thread_state in list(self.thread_states.values()):
+            thread_state.clear()
+            self.monitored_program._merge(thread_state.monitored_program)
+        self.thread_states = {}
+        self.combine(programs)
+
+    def combine(self, programs):
+        # Programs collected elsewhere (eg, by child processes) are merged into the monitored program
+        for program in programs:
+            self.monitored_program._merge(program)
+        self.monitored_program._update_flows_and_info(self.py_tracer.TRACES_LINES, self.max_flows)
+
+    def thread_state(self):
+        thread_id = get_ident()
+        thread_state = self.thread_states.get(thread_id)
+        if thread_state is None:
+            thread_state = self.thread_states[thread_id] = ThreadState(self)
+        return thread_state
+
+    def build_tracer(self):
+        # sys.monitoring is only available in Python 3.12+, otherwise fall back to sys.settrace
+        if self.tracer == 'monitoring' and MonitoringTracer.is_available():
+            return MonitoringTracer(self)
+        if self.tracer == 'setprofile':
+            return ProfileTracer(self)
+        return PyTracer(self)
 
     def init_target(self):
-        if self.method_names:
-            pass
-            # self.module_names = get_module_names(self.method_names)
+        self.matcher = TargetMatcher(self.method_names, self.file_names, self.ignore_files)
+        self.target_codes_cache = {}
+        self.caller_target_codes_cache = {}
 
     def is_valid_frame(self, frame):
 
-        current_filename = frame.f_code.co_filename
-
-        if current_filename.startswith('<') or frame.f_code.co_name == '<module>':
+        if frame.f_code.co_name == '<module>':
             return False
 
-        if self.ignore_files:
-            for ignore in self.ignore_files:
-                if ignore in current_filename:
-                    return False
-
-        if self.file_names:
-            for filename in self.file_names:
-                if filename in current_filename:
-                    return True
-                if frame.f_back:
-                    back_filename = frame.f_back.f_code.co_filename
-                    if filename in back_filename:
-                        return True
-            return False
+        is_valid = self.matcher.file_verdict(frame.f_code.co_filename)
+        if is_valid is None:
+            # With target files, a frame is also valid when its caller is in a target file
+            return frame.f_back is not None and self.matcher.is_target_file(frame.f_back.f_code.co_filename)
+        return is_valid
+
+    def is_target_frame(self, frame):
+        return self.target_method_for_frame(frame) is not None
+
+    def target_method_for_frame(self, frame):
+        # The target method (MethodInfo) of the frame, or None if its events should not be recorded.
+        # It is computed once per code object. When it depends on the caller, only the caller file
+        # is checked per frame.
+        code = frame.f_code
+        if code in self.target_codes_cache:
+            return self.target_codes_cache[code]
+
+        if code in self.caller_target_codes_cache:
+            if self.is_valid_frame(frame):
+                return self.caller_target_codes_cache[code]
+            return None
 
-        # if self.module_names:
-        #     for module_name in self.module_names:
-        #         if module_name in current_filename:
-        #             return True
-        #     return False
+        method_info = None
+        if code.co_name != '<module>' and self.matcher.file_verdict(code.co_filename) is not False:
+            method_info = self.ensure_target_method(frame)
 
-        return True
+        # Comprehensions are only resolved when called from the code in which they are defined
+        if method_info or not is_comprehension(frame):
+            if self.matcher.file_verdict(code.co_filename) is None:
+                self.caller_target_codes_cache[code] = method_info
+            else:
+                self.target_codes_cache[code] = method_info
 
-    def find_call_stack(self, frame):
-        call_stack = []
-        call_stack.append(frame.f_code.co_name)
-        while 'test_' not in frame.f_code.co_name:
-            if not frame.f_back:
-                break
+        if method_info and self.is_valid_frame(frame):
+            return method_info
+        return None
+
+    def target_depends_on_caller(self, code):
+        return self.caller_target_codes_cache.get(code) is not None
+
+    def is_unwinding(self, frame):
+        return is_unwinding(frame)
+
+    def raised_exception(self, frame):
+        # Exception raised at the current line of the frame, if it can be found statically
+        name = analysis_for_frame(frame).raise_names.get(frame.f_lineno)
+        if name is None:
+            return None
+        return resolve_exception(frame, name)
+
+    def create_task(self, loop, coro, **kwargs):
+        # Task factory that records the call stack of the frame creating the task (eg, the coroutine
+        # that gathers it), skipping the frames of asyncio
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+        frame = sys._getframe(1)
+        while frame and is_asyncio_frame(frame):
             frame = frame.f_back
-            full_name = self.get_full_entity_name(frame)
-            if full_name:
-                call_stack.append(full_name)
-            else:
-                break
-        call_stack.reverse()
-        return tuple(call_stack)
+        if frame:
+            self.task_call_stacks[task] = self.thread_state().shadow_stack.frame_stack(frame)
+        return task
+
+    def task_call_stack(self, frame):
+        # The call stack of the task running the frame, if the frame is the coroutine of the task.
+        # Coroutines awaited by their back frame are not the coroutine of a task.
+        if not self.task_call_stacks or not frame.f_code.co_flags & inspect.CO_COROUTINE:
+            return None
+        if frame.f_back and frame.f_back.f_code.co_flags & GENERATOR_FLAGS:
+            return None
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            return None
+        if task is None or getattr(task.get_coro(), 'cr_frame', None) is not frame:
+            return None
+        return self.task_call_stacks.get(task)
 
     def get_full_entity_name(self, frame):
 
@@ -147,51 +505,45 @@ class Collector:
 
         return None
 
-    def ensure_target_method(self, frame, current_entity_name, method_name):
+    def ensure_target_method(self, frame):
 
-        # Handle special cases in which 'method' is already a method or function object
-        if is_method_or_func(method_name):
-            if current_entity_name in self.target_methods_cache:
-                return self.target_methods_cache[current_entity_name]
-            entity = MethodInfo.build(method_name)
-            self.target_methods_cache[current_entity_name] = entity
-            return entity
+        func_or_method = self.ensure_func_or_method(frame)
+        if not func_or_method:
+            return None
 
-        if method_name and not current_entity_name.startswith(method_name) and \
-                not current_entity_name.endswith(method_name):
+        full_name = find_full_name(func_or_method)
+        if not full_name or not self.matcher.is_target_method(full_name):
             return None
 
-        if current_entity_name in self.target_methods_cache:
-            return self.target_methods_cache[current_entity_name]
+        if full_name in self.target_methods_cache:
+            return self.target_methods_cache[full_name]
 
-        func_or_method = self.ensure_func_or_method(frame)
-        if not func_or_method:
-            return None
+        # Handle special cases in which the target is already a method or function object
+        func_or_method = self.matcher.target_func(full_name) or func_or_method
         entity = MethodInfo.build(func_or_method)
-        if not entity:
-            return None
 
-        self.target_methods_cache[current_entity_name] = entity
+        self.target_methods_cache[full_name] = entity
         return entity
 
     def ensure_func_or_method(self, frame):
 
-        filename = frame.f_code.co_filename
-        lineno = frame.f_lineno
-        entity_name = frame.f_code.co_name
+        code = frame.f_code
+
+        # Comprehensions belong to the code in which they are defined
         if is_comprehension(frame):
-            entity_name = frame.f_back.f_code.co_name
-        key = filename, lineno, entity_name
+            if frame.f_back and code in frame.f_back.f_code.co_consts:
+                return self.ensure_func_or_method(frame.f_back)
+            return None
 
-        if key in self.frame_cache:
-            return self.frame_cache[key]
+        if code in self.funcs_cache:
+            return self.funcs_cache[code]
 
-        func_or_method = self.get_func_or_method(frame)
-        if not func_or_method or inspect.isbuiltin(func_or_method) or not is_method_or_func(func_or_method):
-            return None
+        func_or_method = find_func_by_qualname(frame) or self.get_func_or_method(frame)
+        if func_or_method:
+            func_or_method = find_func_with_code(func_or_method, code)
 
-        self.frame_cache[key] = func_or_method
-        return self.frame_cache[key]
+        self.funcs_cache[code] = func_or_method
+        return func_or_method
 
     def get_func_or_method(self, frame):
         try:
@@ -260,94 +612,169 @@ class Collector:
 
         return None
 
-    def update_method_info(self, method_info, frame, event):
+    def update_method_info(self, method_info, frame, event, arg):
         lineno = frame.f_lineno
+        analysis = analysis_for_frame(frame)
 
-        if event == 'line' and line_has_control_flow(frame):
+        if event == 'line' and lineno in analysis.control_flow_lines:
             method_info.control_flow_lines.add(lineno)
 
         if event == 'return':
-            if line_has_return(frame):
+            if lineno in analysis.return_lines:
                 method_info.return_lines.add(lineno)
-            elif line_has_yield(frame):
+            elif lineno in analysis.yield_lines:
                 method_info.yield_lines.add(lineno)
 
         if event == 'exception':
-            method_info.exception_lines.add(lineno)
+            if not is_closing_comprehension(frame, arg):
+                method_info.exception_lines.add(lineno)
 
     def monitor_event(self, frame, event, arg):
 
-        if not self.is_valid_frame(frame):
-            return
-
-        current_method_name = self.get_full_entity_name(frame)
-
-        if current_method_name:
-            if self.method_names:
-                for method_name in self.method_names:
-                    self.monitor_method(frame, event, arg, current_method_name, method_name)
-            elif self.method_names is None:
-                self.monitor_method(frame, event, arg, current_method_name)
+        method_info = self.target_method_for_frame(frame)
 
-    def monitor_method(self, frame, event, arg, current_method_name, method_name=None):
+        if method_info:
+            self.monitor_method(frame, event, arg, method_info)
 
-        method_info = self.ensure_target_method(frame, current_method_name, method_name)
+    def monitor_method(self, frame, event, arg, method_info):
 
-        if method_info and current_method_name == method_info.full_name:
-            self.update_method_info(method_info, frame, event)
+        current_method_name = method_info.full_name
+        thread_state = self.thread_state()
+        monitored_program = thread_state.monitored_program
 
-            if current_method_name not in self.last_frame_lineno:
-                self.last_frame_lineno[current_method_name] = -1
+        self.update_method_info(method_info, frame, event, arg)
 
-            # Tip from Coverage.py
-            # The call event is really a "start frame" event, and happens for
-            # function calls and re-entering generators.  The f_lasti field is
-            # -1 for calls, and a real offset for generators.  Use < 0 as the
-            # line number for calls, and the real line number for generators.
-            if event == 'call' and getattr(frame, 'f_lasti', -1) < 0 and not is_comprehension(frame):
-                if current_method_name not in self.monitored_program:
-                    self.monitored_program[current_method_name] = MonitoredMethod(method_info)
+        if event == 'call' and is_new_call(frame) and not is_comprehension(frame):
+            callers = thread_state.shadow_stack.call_stack(frame)
 
-                call_state = CallState()
-                callers = self.find_call_stack(frame)
-
-                if self.collect_arg_states:
-                    call_state._save_arg_states(inspect.getargvalues(frame), frame.f_lineno)
-
-                frame_id = get_frame_id(frame)
-                monitored_method = self.monitored_program[current_method_name]
-                monitored_method._add_call(call_state, callers, frame_id)
-
-            # Event is line, return, exception or call for re-entering generators
+            if self.event_log:
+                method_call = self.event_log.add_call(method_info, callers, frame.f_lineno)
+            else:
+                if current_method_name not in monitored_program:
+                    monitored_program[current_method_name] = MonitoredMethod(method_info)
+
+                monitored_method = monitored_program[current_method_name]
+                method_call = monitored_method._add_call(CallState(), callers)
+
+            if self.collect_arg_states:
+                self.dispatch((ARG, method_call.call_state, frame.f_lineno, None, arg_values(frame)))
+
+            thread_state.active_frames[id(frame)] = FrameState(frame.f_code, method_call)
+
+        # Event is line, return, exception or call for re-entering generators
+        else:
+            if event == 'return':
+                thread_state.shadow_stack.pop(frame)
+            lineno = frame.f_lineno
+            frame_state = self.frame_state(frame, thread_state.active_frames, event == 'call' and is_new_call(frame))
+            if frame_state:
+                method_call = frame_state.method_call
+
+                current_call_state = method_call.call_state
+                if event == 'line':
+                    method_call._add_run_line(lineno)
+
+                elif event == 'return':
+                    analysis = analysis_for_frame(frame)
+                    if self.collect_return_states and lineno in analysis.return_lines:
+                        self.dispatch((RETURN, current_call_state, lineno, None, {None: arg}))
+                    elif self.collect_yield_states and lineno in analysis.yield_lines:
+                        self.dispatch((YIELD, current_call_state, lineno, None, {None: arg}))
+
+                elif event == 'exception':
+                    if self.collect_exception_states and not is_closing_comprehension(frame, arg):
+                        exception_name = self.monitored_program.value_pool.intern(arg[0].__name__)
+                        exception_type = obj_type(arg[0])
+                        current_call_state._save_exception_state(exception_name, exception_type, lineno)
+
+                if self.collect_var_states and current_call_state:
+                    inline = frame_state.last_line
+                    if self.collect_var_states == VAR_STATES_CHANGES:
+                        self.save_changed_var_states(frame, frame_state, lineno, inline)
+                    else:
+                        self.dispatch((VAR, current_call_state, lineno, inline, frame.f_locals))
+
+                frame_state.last_line = lineno
+                if event == 'return' and frame_state.is_finished(frame):
+                    del thread_state.active_frames[id(frame)]
+                else:
+                    frame_state.raised = event == 'exception'
+
+    def frame_state(self, frame, active_frames, new_frame=False):
+        if new_frame:
+            # Eg, a generator expression, whose id may be the one of a finished frame of the same code
+            active_frames.pop(id(frame), None)
+            frame_state = None
+        else:
+            frame_state = active_state(frame, active_frames)
+        if frame_state is None and is_comprehension(frame):
+            # Comprehensions and generator expressions belong to the call of their enclosing method,
+            # so that they do not create novel flows
+            enclosing_state = active_state(frame.f_back, active_frames)
+            if enclosing_state:
+                frame_state = FrameState(frame.f_code, enclosing_state.method_call, enclosing_state.last_line)
+                active_frames[id(frame)] = frame_state
+        return frame_state
+
+    def save_changed_var_states(self, frame, frame_state, lineno, inline):
+        call_state = frame_state.method_call.call_state
+        f_locals = frame.f_locals
+        if frame_state.mutable_vars is None:
+            frame_state.mutable_vars = set()
+            names = tuple(f_locals)
+        else:
+            names = frame_state.names_to_read(frame.f_code)
+
+        values = {}
+        for name in names:
+            if name not in f_locals:
+                frame_state.mutable_vars.discard(name)
+                continue
+            obj = values[name] = f_locals[name]
+            if may_change_in_place(obj):
+                frame_state.mutable_vars.add(name)
             else:
-                lineno = frame.f_lineno
-                if current_method_name in self.monitored_program:
-                    monitored_method = self.monitored_program[current_method_name]
-                    if monitored_method.calls:
-                        frame_id = get_frame_id(frame)
-                        method_call = monitored_method._get_call_from_id(frame_id)
-                        if method_call:
-
-                            current_call_state = method_call.call_state
-                            if event == 'line':
-                                method_call._add_run_line(lineno)
-                                monitored_method._add_run_line(lineno)
-
-                            elif event == 'return':
-                                if self.collect_return_states and line_has_return(frame):
-                                    current_call_state._save_return_state(obj_value(arg), obj_type(arg), lineno)
-                                elif self.collect_yield_states and line_has_yield(frame):
-                                    current_call_state._save_yield_state(obj_value(arg), obj_type(arg), lineno)
-
-                            elif event == 'exception':
-                                if self.collect_exception_states:
-                                    exception_name = arg[0].__name__
-                                    exception_type = obj_type(arg[0])
-                                    current_call_state._save_exception_state(exception_name, exception_type, lineno)
-
-                            if self.collect_var_states and current_call_state:
-                                argvalues = inspect.getargvalues(frame)
-                                inline = self.last_frame_lineno[current_method_name]
-                                current_call_state._save_var_states(argvalues, lineno, inline)
-
-                self.last_frame_lineno[current_method_name] = lineno
+                frame_state.mutable_vars.discard(name)
+        if values:
+            self.dispatch((CHANGED_VAR, call_state, lineno, inline, values))
+
+    def render(self, obj):
+        if type(obj) is Rendered:
+            return obj
+        return obj_value(obj, self.value_renderer), obj_type(obj)
+
+    def push_event(self, event):
+        # Values that may change in place before the consumer takes the event are copied or rendered now, so that
+        # they are saved as they were. The values (and the locals dict) are copied, since they change on later lines
+        values = {name: self.snapshot(obj) if may_change_in_place(obj) else obj for name, obj in event[-1].items()}
+        self.event_buffer.push(event[:-1] + (values,))
+
+    def snapshot(self, obj):
+        # Lists and dicts of immutable values are shallow copied, which is cheaper than rendering them
+        type_ = type(obj)
+        if type_ is list or type_ is dict:
+            if len(obj) <= self.value_renderer.max_items and set(map(type, obj)) <= IMMUTABLE_TYPES:
+                if type_ is list or set(map(type, obj.values())) <= IMMUTABLE_TYPES:
+                    return obj.copy()
+        return Rendered(self.render(obj))
+
+    def render_values(self, values):
+        return {name: Rendered(self.render(obj)) for name, obj in values.items()}
+
+    def save_states(self, event):
+        # Renders the values of the event and saves them as states of its call
+        kind, call_state, lineno, inline, values = event
+        intern = self.monitored_program.value_pool.intern
+        for name, obj in values.items():
+            value, type = self.render(obj)
+            value = intern(value)
+            if kind == VAR:
+                call_state._save_var_state(name, value, type, lineno, inline)
+            elif kind == CHANGED_VAR:
+                call_state._save_changed_var_state(name, value, type, lineno, inline)
+            elif kind == ARG:
+                call_state._save_arg_state(name, value, type, lineno)
+            elif kind == RETURN:
+                call_state._save_return_state(value, type, lineno)
+            elif kind == YIELD:
+                call_state._save_yield_state(value, type, lineno)
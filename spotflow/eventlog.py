@@ -0,0 +1,175 @@
+import json
+import struct
+import threading
+from itertools import count
+from spotflow.model import MonitoredProgram, MonitoredMethod, CallState
+from spotflow.info import MethodInfo
+
+# Recording mode: instead of building the monitored program while tracing, the collector appends fixed-size
+# records to a binary file, with method names, call stacks, values and types interned as ids. The monitored
+# program is rebuilt from the file afterwards, possibly by another process. Records only hold plain data (method
+# infos are JSON), so reading a log does not run code.
+
+# kind, call id (or string/method id), line, inline, and three ids that depend on the kind
+RECORD = struct.Struct('<BxxxIiiIII')
+
+STRING, METHOD, CALL, ARG, LINE, RETURN, YIELD, EXCEPTION, VAR = range(9)
+
+# Strings are forgotten (and written again when seen again) once too many are interned, so that memory is bounded
+MAX_INTERNED_STRINGS = 100000
+STACK_SEPARATOR = '\x1f'
+
+
+class EventLog:
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.strings = {}
+        # next() of count is atomic, so that threads do not get the same ids
+        self.string_ids = count(1)
+        self.call_ids = count(1)
+        self.method_ids = {}
+        self.next_method_ids = count(1)
+        self.methods = {}
+        # Ids are only published once their records are written, so that other threads do not write records
+        # that refer to ids that are not defined yet
+        self.intern_lock = threading.Lock()
+
+    def write(self, kind, ident, lineno=0, inline=0, a=0, b=0, c=0):
+        self.file.write(RECORD.pack(kind, ident, lineno, inline, a, b, c))
+
+    def write_data(self, kind, ident, data):
+        # Records and their data are written at once, so that records of other threads do not interleave
+        self.file.write(RECORD.pack(kind, ident, 0, 0, len(data), 0, 0) + data)
+
+    def intern(self, text):
+        string_id = self.strings.get(text)
+        if string_id is None:
+            with self.intern_lock:
+                string_id = self.strings.get(text)
+                if string_id is None:
+                    string_id = next(self.string_ids)
+                    self.write_data(STRING, string_id, text.encode('utf-8', 'surrogatepass'))
+                    if len(self.strings) >= MAX_INTERNED_STRINGS:
+                        self.strings.clear()
+                    self.strings[text] = string_id
+        return string_id
+
+    def method_id(self, method_info):
+        method_id = self.method_ids.get(method_info.full_name)
+        if method_id is None:
+            with self.intern_lock:
+                method_id = self.method_ids.get(method_info.full_name)
+                if method_id is None:
+                    method_id = next(self.next_method_ids)
+                    self.methods[method_id] = method_info
+                    self.write_data(METHOD, method_id, encode_method_info(method_info))
+                    self.method_ids[method_info.full_name] = method_id
+        return method_id
+
+    def add_call(self, method_info, call_stack, lineno):
+        call = RecordedCall(self, next(self.call_ids))
+        stack_id = self.intern(STACK_SEPARATOR.join(call_stack))
+        self.write(CALL, call.call_id, lineno, a=self.method_id(method_info), b=stack_id)
+        return call
+
+    def close(self):
+        # Method infos are written again, with the lines updated while tracing
+        for method_id, method_info in self.methods.items():
+            self.write_data(METHOD, method_id, encode_method_info(method_info))
+        self.file.close()
+
+
+class RecordedCall:
+
+    # Method call (and its call state) of an active frame in recording mode: its events are written to the log
+
+    __slots__ = ('event_log', 'call_id', 'call_state', 'var_values')
+
+    def __init__(self, event_log, call_id):
+        self.event_log = event_log
+        self.call_id = call_id
+        self.call_state = self
+        # Last value of each variable, for change-driven var states
+        self.var_values = {}
+
+    def _add_run_line(self, lineno):
+        self.event_log.write(LINE, self.call_id, lineno)
+
+    def _save_state(self, kind, name, value, type, lineno, inline=0):
+        log = self.event_log
+        name_id = log.intern(name) if name is not None else 0
+        log.write(kind, self.call_id, lineno, inline, log.intern(value), log.intern(type), name_id)
+
+    def _save_arg_state(self, name, value, type, lineno):
+        self._save_state(ARG, name, value, type, lineno)
+
+    def _save_var_state(self, name, value, type, lineno, inline):
+        self._save_state(VAR, name, value, type, lineno, inline)
+
+    def _save_changed_var_state(self, name, value, type, lineno, inline):
+        if name not in self.var_values or self.var_values[name] != value:
+            self.var_values[name] = value
+            self._save_state(VAR, name, value, type, lineno, inline)
+
+    def _save_yield_state(self, value, type, lineno):
+        self._save_state(YIELD, None, value, type, lineno)
+
+    def _save_return_state(self, value, type, lineno):
+        self._save_state(RETURN, None, value, type, lineno)
+
+    def _save_exception_state(self, value, type, lineno):
+        self._save_state(EXCEPTION, None, value, type, lineno)
+
+
+def encode_method_info(method_info):
+    return json.dumps(method_info.to_data()).encode('utf-8')
+
+
+def read_records(path):
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            record = RECORD.unpack(header)
+            data = f.read(record[4]) if record[0] in (STRING, METHOD) else None
+            yield record, data
+
+
+def read_event_log(path):
+    monitored_program = MonitoredProgram()
+    strings = {0: None}
+    methods = {}
+    calls = {}
+
+    for (kind, ident, lineno, inline, a, b, c), data in read_records(path):
+        if kind == STRING:
+            # Strings written again (once forgotten by the log) are shared too
+            strings[ident] = monitored_program.value_pool.intern(data.decode('utf-8', 'surrogatepass'))
+        elif kind == METHOD:
+            method_info = MethodInfo.from_data(json.loads(data))
+            if ident in methods:
+                methods[ident].info = method_info
+            else:
+                methods[ident] = monitored_program[method_info.full_name] = MonitoredMethod(method_info)
+        elif kind == CALL:
+            call_stack = tuple(strings[b].split(STACK_SEPARATOR))
+            calls[ident] = methods[a]._add_call(CallState(), call_stack)
+        elif kind == LINE:
+            calls[ident]._add_run_line(lineno)
+        else:
+            call_state = calls[ident].call_state
+            value, type, name = strings[a], strings[b], strings[c]
+            if kind == ARG:
+                call_state._save_arg_state(name, value, type, lineno)
+            elif kind == VAR:
+                call_state._save_var_state(name, value, type, lineno, inline)
+            elif kind == RETURN:
+                call_state._save_return_state(value, type, lineno)
+            elif kind == YIELD:
+                call_state._save_yield_state(value, type, lineno)
+            elif kind == EXCEPTION:
+                call_state._save_exception_state(value, type, lineno)
+
+    return monitored_program
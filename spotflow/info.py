@@ -1,7 +1,9 @@
 from collections import Counter
-from spotflow.utils import line_intersection, get_html_lines, find_executable_linenos, get_metadata, escape, ratio
+from spotflow.utils import get_metadata, escape, ratio
+from spotflow.static_analysis import analyze_file, html_lines_for_code
 
-executable_lines_for_file = {}
+# Flags of the line statuses of a method
+EXECUTABLE, DEFINITION, DOCSTRING = 1, 2, 4
 
 
 class MethodInfo:
@@ -20,6 +22,7 @@ class MethodInfo:
 
         self.code_lines = None
         self.html_lines = None
+        self.line_statuses = None
 
         # Updated in collector
         self.return_lines = set()
@@ -46,9 +49,8 @@ class MethodInfo:
         return len(self.exception_lines) > 0
 
     def executable_lines(self):
-        exec_lines = self._ensure_executable_lines_for_file()
-        my_lines = range(self.start_line, self.end_line + 1)
-        return line_intersection(exec_lines, my_lines)
+        return [self.start_line + offset for offset, status in enumerate(self._line_statuses())
+                if status & EXECUTABLE]
 
     def get_code_lines(self):
         if not self.code_lines:
@@ -57,7 +59,7 @@ class MethodInfo:
 
     def get_html_lines(self):
         if not self.html_lines:
-            self.html_lines = get_html_lines(self.code)
+            self.html_lines = html_lines_for_code(self.code)
         return self.html_lines
 
     def get_code_line_at_lineno(self, n):
@@ -75,13 +77,45 @@ class MethodInfo:
     def _has_lineno(self, lineno):
         return lineno in range(self.start_line, self.end_line + 1)
 
-    def _ensure_executable_lines_for_file(self):
-        if self.filename not in executable_lines_for_file:
-            executable_lines_for_file[self.filename] = find_executable_linenos(self.filename)
-        return executable_lines_for_file[self.filename]
+    def _line_statuses(self):
+        # One byte of flags per line of the method, built once, so that lines are checked in constant time.
+        # Definition lines are the decorators and header of the method itself, whose def line trace finds
+        # executable, but not the ones of nested definitions, which are run like other statements
+        if self.line_statuses is None:
+            analysis = analyze_file(self.filename)
+            exec_lines = analysis.executable_lines
+            body_line = analysis.definition_bodies.get(self.start_line, self.start_line)
+            statuses = bytearray(self.end_line - self.start_line + 1)
+            for offset, lineno in enumerate(range(self.start_line, self.end_line + 1)):
+                if lineno in exec_lines:
+                    statuses[offset] |= EXECUTABLE
+                if lineno < body_line:
+                    statuses[offset] |= DEFINITION
+                if lineno in analysis.docstring_lines:
+                    statuses[offset] |= DOCSTRING
+            self.line_statuses = statuses
+        return self.line_statuses
+
+    def _line_status(self, lineno):
+        statuses = self._line_statuses()
+        offset = lineno - self.start_line
+        if 0 <= offset < len(statuses):
+            return statuses[offset]
+        return 0
 
     def _line_is_executable(self, lineno):
-        return lineno in self.executable_lines()
+        return bool(self._line_status(lineno) & EXECUTABLE)
+
+    def _line_is_body(self, lineno):
+        # Executable lines that the calls may run or not
+        return self._line_status(lineno) & (EXECUTABLE | DEFINITION | DOCSTRING) == EXECUTABLE
+
+    def _next_executable_line(self, lineno):
+        statuses = self._line_statuses()
+        for offset in range(lineno - self.start_line + 1, len(statuses)):
+            if statuses[offset] & EXECUTABLE:
+                return self.start_line + offset
+        return None
 
     def _executable_lines_without_def(self, monitored_method):
         exec_lines = self.executable_lines()
@@ -89,19 +123,68 @@ class MethodInfo:
         first_run_line_index = exec_lines.index(first_run_line)
         return exec_lines[first_run_line_index:]
 
+    def _merge(self, other):
+        self.return_lines.update(other.return_lines)
+        self.yield_lines.update(other.yield_lines)
+        self.exception_lines.update(other.exception_lines)
+        self.control_flow_lines.update(other.control_flow_lines)
+
     def _update_call_info(self, monitored_method):
         self.run_lines_count = len(monitored_method.run_lines)
         # self.executable_lines_count = len(self._executable_lines_without_def(monitored_method))
         self.executable_lines_count = len(self.executable_lines()) - 1
         self.coverage_ratio = ratio(self.run_lines_count, self.executable_lines_count)
 
+        # The calls of the flows are already counted, so only the other calls are read again
+        if monitored_method.flows:
+            call_stats = CallStats(monitored_method.other_calls)
+            for flow in monitored_method.flows:
+                call_stats._merge(flow.info.call_stats)
+        else:
+            call_stats = CallStats(monitored_method.calls)
+
         self.total_calls = len(monitored_method.calls)
-        self.total_tests = len(monitored_method.tests())
-        self.total_exceptions = len(monitored_method.exception_states())
+        self.total_tests = len(call_stats.tests)
+        self.total_exceptions = call_stats.exception_count()
 
         self.total_flows = len(monitored_method.flows)
-        self.top_flow_calls = monitored_method.flows[0].info.call_count
-        self.top_flow_ratio = monitored_method.flows[0].info.call_ratio
+        if monitored_method.flows:
+            self.top_flow_calls = monitored_method.flows[0].info.call_count
+            self.top_flow_ratio = monitored_method.flows[0].info.call_ratio
+        else:
+            # Calls-only mode, coverage and flows are unknown
+            self.coverage_ratio = 'NA'
+            self.top_flow_calls = 0
+            self.top_flow_ratio = 'NA'
+
+    def to_data(self):
+        # Plain data of the method, eg, to save it as JSON. Line statuses and code lines are built again
+        return {
+            'module_name': self.module_name,
+            'class_name': self.class_name,
+            'name': self.name,
+            'full_name': self.full_name,
+            'filename': self.filename,
+            'code': self.code,
+            'start_line': self.start_line,
+            'end_line': self.end_line,
+            'return_lines': sorted(self.return_lines),
+            'yield_lines': sorted(self.yield_lines),
+            'exception_lines': sorted(self.exception_lines),
+            'control_flow_lines': sorted(self.control_flow_lines),
+        }
+
+    @staticmethod
+    def from_data(data):
+        method_info = MethodInfo(data['module_name'], data['class_name'], data['name'], data['full_name'],
+                                 data['filename'], data['code'])
+        method_info.start_line = data['start_line']
+        method_info.end_line = data['end_line']
+        method_info.return_lines = set(data['return_lines'])
+        method_info.yield_lines = set(data['yield_lines'])
+        method_info.exception_lines = set(data['exception_lines'])
+        method_info.control_flow_lines = set(data['control_flow_lines'])
+        return method_info
 
     def __str__(self):
         return self.full_name
@@ -134,10 +217,12 @@ class FlowInfo:
         total_calls = len(method_flow.monitored_method.calls)
         self.call_ratio = ratio(self.call_count, total_calls)
 
-        self.arg_values = Analysis(method_flow).most_common_args_pretty()
-        self.return_values = Analysis(method_flow).most_common_return_values_pretty()
-        self.yield_values = Analysis(method_flow).most_common_yield_values_pretty()
-        self.exception_values = Analysis(method_flow).most_common_exception_values_pretty()
+        self.call_stats = CallStats(method_flow.calls)
+        analysis = Analysis(method_flow)
+        self.arg_values = analysis._pretty_args(self.call_stats.most_common_arg_values())
+        self.return_values = analysis._pretty_return_values(self.call_stats.return_values.most_common(10))
+        self.yield_values = analysis._pretty_return_values(self.call_stats.yield_values.most_common(10))
+        self.exception_values = analysis._pretty_return_values(self.call_stats.exception_values.most_common(10))
 
     def _append(self, other):
         self.lines.append(other)
@@ -157,8 +242,56 @@ class FlowInfo:
         return self.lines[position]
 
 
+class CallStats:
+
+    # Counts of the states of some calls, taken in a single pass: the values of their args (but self), returns,
+    # yields and exceptions, and the tests that started them. Counters keep the order of the first calls,
+    # so their most common values are the same as the ones of Analysis
+
+    def __init__(self, calls=()):
+        self.arg_values = {}
+        self.return_values = Counter()
+        self.yield_values = Counter()
+        self.exception_values = Counter()
+        self.tests = set()
+        for call in calls:
+            self._add(call)
+
+    def _add(self, call):
+        self.tests.add(call.call_stack[0])
+        call_state = call.call_state
+        for arg in call_state.arg_states:
+            if arg.name != 'self':
+                values = self.arg_values.get(arg.name)
+                if values is None:
+                    values = self.arg_values[arg.name] = Counter()
+                values[arg.value] += 1
+        for yield_state in call_state.yield_states:
+            self.yield_values[yield_state.value] += 1
+        if call_state.return_state is not None:
+            self.return_values[call_state.return_state.value] += 1
+        if call_state.exception_state is not None:
+            self.exception_values[call_state.exception_state.value] += 1
+
+    def _merge(self, other):
+        for name, values in other.arg_values.items():
+            self.arg_values.setdefault(name, Counter()).update(values)
+        self.return_values.update(other.return_values)
+        self.yield_values.update(other.yield_values)
+        self.exception_values.update(other.exception_values)
+        self.tests.update(other.tests)
+
+    def most_common_arg_values(self, n=10):
+        return {name: values.most_common(n) for name, values in self.arg_values.items()}
+
+    def exception_count(self):
+        return sum(self.exception_values.values())
+
+
 class LineInfo:
 
+    __slots__ = ('lineno', 'lineno_entity', 'run_status', 'type', 'state', 'method_info')
+
     def __init__(self, lineno, lineno_entity, run_status, type, state, method_info):
         self.lineno = lineno
         self.lineno_entity = lineno_entity
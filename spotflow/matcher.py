@@ -0,0 +1,108 @@
+import re
+import fnmatch
+from spotflow.utils import find_full_name, is_method_or_func
+
+REGEX_PREFIX = 're:'
+GLOB_PREFIX = 'glob:'
+
+
+class TargetMatcher:
+
+    # Target methods and files are compiled once, so the cost of matching does not grow with
+    # the number of targets. Names are prefixes/suffixes (methods) or substrings (files), unless
+    # they start with 're:' (regular expression) or 'glob:' (shell-style wildcards).
+    # Results are memoized per method name and per filename.
+
+    def __init__(self, method_names=None, file_names=None, ignore_files=None):
+        self.match_all_methods = method_names is None
+        self.target_funcs = {}
+        self.method_prefixes = ()
+        self.method_pattern = None
+        if method_names is not None:
+            self._compile_method_names(method_names)
+
+        self.file_pattern = compile_file_names(file_names) if file_names else None
+        self.ignore_pattern = compile_file_names(ignore_files) if ignore_files else None
+
+        self.methods_cache = {}
+        self.files_cache = {}
+        self.target_files_cache = {}
+
+    def is_target_method(self, full_name):
+        if self.match_all_methods:
+            return True
+        if full_name not in self.methods_cache:
+            self.methods_cache[full_name] = self._match_method(full_name)
+        return self.methods_cache[full_name]
+
+    def target_func(self, full_name):
+        return self.target_funcs.get(full_name)
+
+    def file_verdict(self, filename):
+        # True or False when the file decides whether its code is valid,
+        # None when it depends on the caller (ie, the caller must be in a target file)
+        if filename not in self.files_cache:
+            self.files_cache[filename] = self._file_verdict(filename)
+        return self.files_cache[filename]
+
+    def is_target_file(self, filename):
+        if filename not in self.target_files_cache:
+            self.target_files_cache[filename] = self.file_pattern is None or \
+                                                self.file_pattern.search(filename) is not None
+        return self.target_files_cache[filename]
+
+    def _file_verdict(self, filename):
+        if filename.startswith('<'):
+            return False
+        if self.ignore_pattern and self.ignore_pattern.search(filename):
+            return False
+        if self.is_target_file(filename):
+            return True
+        return None
+
+    def _match_method(self, full_name):
+        if full_name in self.target_funcs:
+            return True
+        if self.method_prefixes and (full_name.startswith(self.method_prefixes) or
+                                     full_name.endswith(self.method_prefixes)):
+            return True
+        if self.method_pattern and self.method_pattern.search(full_name):
+            return True
+        return False
+
+    def _compile_method_names(self, method_names):
+        prefixes = []
+        patterns = []
+        for method_name in method_names:
+            if is_method_or_func(method_name):
+                self.target_funcs[find_full_name(method_name)] = method_name
+            elif method_name.startswith(REGEX_PREFIX):
+                patterns.append(method_name[len(REGEX_PREFIX):])
+            elif method_name.startswith(GLOB_PREFIX):
+                patterns.append(glob_to_regex(method_name[len(GLOB_PREFIX):]))
+            else:
+                prefixes.append(method_name)
+        self.method_prefixes = tuple(prefixes)
+        if patterns:
+            self.method_pattern = compile_patterns(patterns)
+
+
+def compile_file_names(file_names):
+    patterns = []
+    for file_name in file_names:
+        if file_name.startswith(REGEX_PREFIX):
+            patterns.append(file_name[len(REGEX_PREFIX):])
+        elif file_name.startswith(GLOB_PREFIX):
+            patterns.append(glob_to_regex(file_name[len(GLOB_PREFIX):]))
+        else:
+            patterns.append(re.escape(file_name))
+    return compile_patterns(patterns)
+
+
+def compile_patterns(patterns):
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+
+
+def glob_to_regex(glob):
+    # Globs match the whole name
+    return f'^{fnmatch.translate(glob)}'
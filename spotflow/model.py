@@ -1,11 +1,23 @@
-from spotflow.utils import obj_value, obj_type
+from array import array
+from collections.abc import Sequence
+from itertools import islice
 from spotflow.info import *
 
+# Longest loop body (in run lines) whose repetitions are stored once in RunLines, and the fewest
+# repeated lines worth a block (shorter repetitions stay in the array of lines)
+MAX_LOOP_PERIOD = 64
+MIN_LOOP_LINES = 32
+
+# Flows (distinct sets of run lines) kept per method, most common first. The calls of the other flows are
+# kept in MonitoredMethod.other_calls
+MAX_FLOWS = 10
+
 
 class MonitoredProgram:
 
     def __init__(self):
         self.monitored_methods = {}
+        self.value_pool = ValuePool()
 
     def all_methods(self):
         return list(self.monitored_methods.values())
@@ -26,11 +38,38 @@ class MonitoredProgram:
             for call in m.calls:
                 call.show_objects()
 
-    def _update_flows_and_info(self):
+    def _update_flows_and_info(self, compute_flows=True, max_flows=MAX_FLOWS):
+        # Flows need the run lines, which are not collected in calls-only mode
         for method in self.monitored_methods.values():
-            method._compute_flows()
+            if compute_flows:
+                method._compute_flows(max_flows)
             method._update_call_info()
 
+    def _merge(self, other):
+        # The methods and calls of other (eg, collected in another thread) are moved to this program
+        for method in list(other.monitored_methods.values()):
+            if method.full_name in self.monitored_methods:
+                self.monitored_methods[method.full_name]._merge(method)
+            else:
+                self.monitored_methods[method.full_name] = method
+
+    def to_data(self):
+        # Plain data of the methods and their calls, eg, to save them as JSON. The names, values and types of
+        # the states and call stacks are stored once in a table of values, which they refer to by position
+        values = {}
+        intern = lambda value: values.setdefault(value, len(values))
+        methods = [method.to_data(intern) for method in self.monitored_methods.values()]
+        return {'values': list(values), 'methods': methods}
+
+    @staticmethod
+    def from_data(data):
+        monitored_program = MonitoredProgram()
+        values = [monitored_program.value_pool.intern(value) for value in data['values']]
+        for method_data in data['methods']:
+            method = MonitoredMethod.from_data(method_data, values)
+            monitored_program[method.full_name] = method
+        return monitored_program
+
     def __getitem__(self, key):
         return self.monitored_methods[key]
 
@@ -50,6 +89,23 @@ class MonitoredProgram:
         return iter(self.monitored_methods.values())
 
 
+class ValuePool:
+
+    # Distinct values (reprs) of the states of a program. The same reprs recur in many calls and lines,
+    # so states with equal values share one string, which is compared by identity first
+
+    __slots__ = ('values',)
+
+    def __init__(self):
+        self.values = {}
+
+    def intern(self, value):
+        return self.values.setdefault(value, value)
+
+    def __len__(self):
+        return len(self.values)
+
+
 class CallContainer:
 
     def __init__(self, calls):
@@ -127,8 +183,8 @@ class MonitoredMethod(CallContainer):
         self.name = method_info.name
         self.full_name = method_info.full_name
         self.flows = []
+        self.other_calls = []
         self.run_lines = {}
-        self.calls_by_id = {}
 
     def distinct_run_lines(self):
         return self.run_lines.keys()
@@ -145,28 +201,59 @@ class MonitoredMethod(CallContainer):
         line_freq = self.run_lines.get(lineno, 0)
         self.run_lines[lineno] = line_freq + 1
 
-    def _get_call_from_id(self, call_id):
-        return self.calls_by_id.get(call_id, None)
-
-    def _add_call(self, call_state, call_stack, call_id):
+    def _add_call(self, call_state, call_stack):
         call = MethodCall(call_state, call_stack, self)
         super()._add_call(call)
-        self.calls_by_id[call_id] = call
         return call
 
+    def _merge(self, other):
+        if other.info is not self.info:
+            self.info._merge(other.info)
+        for call in list(other.calls):
+            call.monitored_method = self
+            self.calls.append(call)
+        for lineno, line_freq in list(other.run_lines.items()):
+            self.run_lines[lineno] = self.run_lines.get(lineno, 0) + line_freq
+
+    def to_data(self, intern):
+        return {'info': self.info.to_data(), 'run_lines': list(self.run_lines.items()),
+                'calls': [call.to_data(intern) for call in self.calls]}
+
+    @staticmethod
+    def from_data(data, values):
+        monitored_method = MonitoredMethod(MethodInfo.from_data(data['info']))
+        monitored_method.run_lines = dict(data['run_lines'])
+        monitored_method.calls = [MethodCall.from_data(call_data, monitored_method, values)
+                                  for call_data in data['calls']]
+        return monitored_method
+
     def _add_flow(self, flow_pos, distinct_run_lines, flow_calls):
         flow = MethodFlow(flow_pos, distinct_run_lines, flow_calls, self)
         self.flows.append(flow)
         return flow
 
-    def _compute_flows(self):
-        most_common_run_lines = Analysis(self).most_common_run_lines()
-        flow_pos = 0
-        for run_lines in most_common_run_lines:
-            flow_pos += 1
-            distinct_run_lines = run_lines[0]
-
-            flow_calls = self._select_calls_by_lines(distinct_run_lines)
+    def _compute_flows(self, max_flows=MAX_FLOWS):
+        # Flows are computed again when calls are merged. Calls are grouped by their distinct run lines in
+        # a single pass, and flows are sorted by their number of calls (ties keep the order of the first call)
+        self.flows = []
+        self.other_calls = []
+        flows_calls = {}
+        for call in self.calls:
+            distinct_run_lines = tuple(call.distinct_run_lines())
+            flow_calls = flows_calls.get(distinct_run_lines)
+            if flow_calls is None:
+                flows_calls[distinct_run_lines] = [call]
+            else:
+                flow_calls.append(call)
+
+        most_common_flows = sorted(flows_calls.items(), key=lambda each: len(each[1]), reverse=True)
+        # None or 0 keeps all flows
+        if max_flows:
+            for distinct_run_lines, flow_calls in most_common_flows[max_flows:]:
+                self.other_calls.extend(flow_calls)
+            most_common_flows = most_common_flows[:max_flows]
+
+        for flow_pos, (distinct_run_lines, flow_calls) in enumerate(most_common_flows, 1):
             flow = self._add_flow(flow_pos, distinct_run_lines, flow_calls)
             flow._update_flow_info()
 
@@ -185,41 +272,33 @@ class MethodFlow(CallContainer):
         self.distinct_run_lines = distinct_run_lines
         self.monitored_method = monitored_method
         self.info = None
-        self.found_first_run_line = False
 
     def _update_flow_info(self):
         lineno = 0
         self.info = FlowInfo(self)
-        self.found_first_run_line = False
+        run_lines = set(self.distinct_run_lines)
 
         for lineno_entity in range(self.monitored_method.info.start_line, self.monitored_method.info.end_line+1):
             lineno += 1
 
-            line_status = self._get_line_status(lineno_entity)
+            line_status = self._get_line_status(lineno_entity, run_lines)
             line_type, line_state = self._get_line_state(lineno_entity)
             line_info = LineInfo(lineno, lineno_entity, line_status, line_type, line_state, self.monitored_method.info)
 
             self.info._append(line_info)
             self.info._update_run_status(line_info)
 
-    def _get_line_status(self, current_line):
+    def _get_line_status(self, current_line, run_lines):
 
-        if current_line in self.distinct_run_lines:
-            self.found_first_run_line = True
+        if current_line in run_lines:
             return RunStatus.RUN
 
-        # _find_executable_linenos of trace returns method/function definitions as executable lines (?).
-        # We should flag those definitions as not executable lines (NOT_EXEC). Otherwise, the definitions would impact
-        # on the flows, coverage, etc. The solution for now is flagging all first lines as not executable until we
-        # find the first run line. This way, the definitions are flagged as not executable lines...
-        if not self.found_first_run_line:
-            return RunStatus.NOT_EXEC
-
-        if current_line not in self.distinct_run_lines:
-            if not self.monitored_method.info._line_is_executable(current_line):
-                return RunStatus.NOT_EXEC
+        # _find_executable_linenos of trace returns method/function definitions as executable lines, but the
+        # definition (and docstring) of the method is not run by its calls, so it is flagged as not executable
+        if self.monitored_method.info._line_is_body(current_line):
+            return RunStatus.NOT_RUN
 
-        return RunStatus.NOT_RUN
+        return RunStatus.NOT_EXEC
 
     def _get_line_state(self, current_line, n=0):
         call = self.calls[n]
@@ -228,11 +307,15 @@ class MethodFlow(CallContainer):
 
 class MethodCall:
 
+    # Calls and their states are created for every monitored call and line, so they have no __dict__
+
+    __slots__ = ('call_state', 'call_stack', 'monitored_method', 'run_lines')
+
     def __init__(self, call_state, call_stack, monitored_method):
         self.call_state = call_state
         self.call_stack = call_stack
         self.monitored_method = monitored_method
-        self.run_lines = []
+        self.run_lines = RunLines()
 
     def is_directly_called_from_test(self):
         caller = self.call_stack[-2]
@@ -243,7 +326,7 @@ class MethodCall:
         return '.test_' in test_name
 
     def distinct_run_lines(self):
-        return sorted(list(set(self.run_lines)))
+        return self.run_lines.distinct()
 
     def show_objects(self):
         print('MethodCall')
@@ -278,21 +361,185 @@ class MethodCall:
     def _line_var_states(self, states):
         return LineType.VAR, states
 
+    def to_data(self, intern):
+        return {'call_stack': [intern(each) for each in self.call_stack], 'run_lines': self.run_lines.to_data(),
+                'call_state': self.call_state.to_data(intern)}
+
+    @staticmethod
+    def from_data(data, monitored_method, values):
+        call = MethodCall(CallState.from_data(data['call_state'], values),
+                          tuple(values[each] for each in data['call_stack']), monitored_method)
+        call.run_lines = RunLines.from_data(data['run_lines'])
+        return call
+
     def _add_run_line(self, lineno):
         self.run_lines.append(lineno)
+        self.monitored_method._add_run_line(lineno)
 
     def __eq__(self, other):
         return other == self.run_lines
 
 
+class RunLines:
+
+    # Lines run by a call, in order, which compare equal to the list of the same lines. Lines are stored in
+    # arrays of unsigned ints instead of lists of int objects. When a line jumps back to a line run in the
+    # last MAX_LOOP_PERIOD lines (ie, a loop restarts) and the lines since then repeat the ones before,
+    # they are stored once as a block with its number of repetitions, until the loop takes another path.
+    # Loops whose paths alternate repeat a period of several iterations.
+
+    __slots__ = ('segments', 'literal', 'block', 'repeats', 'position', 'distinct_lines')
+
+    def __init__(self, lines=()):
+        # Closed (lines, repetitions), lines not in a loop, and the repeating loop block with the next position in it
+        self.segments = []
+        self.literal = array('I')
+        self.block = None
+        self.repeats = 0
+        self.position = 0
+        self.distinct_lines = None
+        for lineno in lines:
+            self.append(lineno)
+
+    def append(self, lineno):
+        block = self.block
+        if block is not None:
+            position = self.position
+            if block[position] == lineno:
+                position += 1
+                if position == len(block):
+                    self.position = 0
+                    self.repeats += 1
+                else:
+                    self.position = position
+                return
+            # The loop took another path: the partial iteration starts new lines
+            self.close_loop()
+
+        literal = self.literal
+        if literal and lineno <= literal[-1]:
+            literal.append(lineno)
+            self.find_loop(lineno)
+        else:
+            literal.append(lineno)
+        self.distinct_lines = None
+
+    def find_loop(self, lineno):
+        literal = self.literal
+        end = len(literal) - 1
+        # Periods are the distances to the previous runs of the line, shortest first
+        previous = literal[max(0, end - MAX_LOOP_PERIOD):end].tolist()
+        previous.reverse()
+        period = 0
+        while True:
+            try:
+                period = previous.index(lineno, period) + 1
+            except ValueError:
+                return
+            start = end - 2 * period
+            if start < 0:
+                return
+            if literal[start:end - period] == literal[end - period:end]:
+                break
+
+        # The last line starts a third repetition
+        if start:
+            self.segments.append((literal[:start], 1))
+        self.block = literal[end - period:end]
+        self.repeats, self.position = (3, 0) if period == 1 else (2, 1)
+        self.literal = array('I')
+
+    def close_loop(self):
+        block, repeats, position = self.block, self.repeats, self.position
+        self.block = None
+        if len(block) * repeats >= MIN_LOOP_LINES:
+            self.segments.append((block, repeats))
+            self.literal = block[:position]
+            return
+        # Short repetitions go back to the lines before them
+        segments = self.segments
+        literal = segments.pop()[0] if segments and segments[-1][1] == 1 else array('I')
+        literal.extend(block * repeats)
+        literal.extend(block[:position])
+        self.literal = literal
+
+    def to_data(self):
+        return {'segments': [[block.tolist(), repeats] for block, repeats in self.segments],
+                'literal': self.literal.tolist(), 'block': None if self.block is None else self.block.tolist(),
+                'repeats': self.repeats, 'position': self.position}
+
+    @staticmethod
+    def from_data(data):
+        run_lines = RunLines()
+        run_lines.segments = [(array('I', block), repeats) for block, repeats in data['segments']]
+        run_lines.literal = array('I', data['literal'])
+        run_lines.block = None if data['block'] is None else array('I', data['block'])
+        run_lines.repeats = data['repeats']
+        run_lines.position = data['position']
+        return run_lines
+
+    def distinct(self):
+        # The lines of each block are only read once
+        if self.distinct_lines is None:
+            lines = set(self.literal)
+            for block, repeats in self.segments:
+                lines.update(block)
+            if self.block is not None:
+                lines.update(self.block)
+            self.distinct_lines = sorted(lines)
+        return list(self.distinct_lines)
+
+    def __iter__(self):
+        for block, repeats in self.segments:
+            for _ in range(repeats):
+                yield from block
+        if self.block is not None:
+            for _ in range(self.repeats):
+                yield from self.block
+            yield from self.block[:self.position]
+        yield from self.literal
+
+    def __len__(self):
+        length = len(self.literal)
+        for block, repeats in self.segments:
+            length += len(block) * repeats
+        if self.block is not None:
+            length += len(self.block) * self.repeats + self.position
+        return length
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index >= 0:
+            for lineno in islice(self, index, None):
+                return lineno
+            raise IndexError('run line index out of range')
+        return list(self)[index]
+
+    def __contains__(self, lineno):
+        return lineno in self.distinct()
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class CallState:
 
+    __slots__ = ('var_states', 'arg_states', 'yield_states', 'return_state', 'exception_state', 'line_states')
+
     def __init__(self):
         self.var_states = {}
         self.arg_states = []
         self.yield_states = []
         self.return_state = None
         self.exception_state = None
+        self.line_states = None
 
     def has_argument(self):
         return len(self.arg_states) > 0 and self.arg_states[0].name != 'self'
@@ -332,46 +579,75 @@ class CallState:
         if self.has_exception():
             print('ExceptionState: ' + str(self.exception_state))
 
+    def to_data(self, intern):
+        state = lambda each: [intern(each.value), intern(each.type), each.lineno]
+        return {
+            'args': [[intern(each.name)] + state(each) for each in self.arg_states],
+            'vars': [[intern(name), [[intern(value), intern(type), lineno, inline, bool(changed)]
+                                     for value, type, lineno, inline, changed in zip(var.values, var.types,
+                                                                                      var.linenos, var.inlines,
+                                                                                      var.changes)]]
+                     for name, var in self.var_states.items()],
+            'yields': [state(each) for each in self.yield_states],
+            'return': state(self.return_state) if self.return_state is not None else None,
+            'exception': state(self.exception_state) if self.exception_state is not None else None,
+        }
+
+    @staticmethod
+    def from_data(data, values):
+        call_state = CallState()
+        call_state.arg_states = [ArgState(values[name], values[value], values[type], lineno)
+                                 for name, value, type, lineno in data['args']]
+        for name, states in data['vars']:
+            var_state = call_state.var_states[values[name]] = VarStateHistory(values[name])
+            for value, type, lineno, inline, value_has_changed in states:
+                var_state._append(values[value], values[type], lineno, inline, value_has_changed)
+        call_state.yield_states = [YieldState(values[value], values[type], lineno)
+                                   for value, type, lineno in data['yields']]
+        if data['return']:
+            value, type, lineno = data['return']
+            call_state.return_state = ReturnState(values[value], values[type], lineno)
+        if data['exception']:
+            value, type, lineno = data['exception']
+            call_state.exception_state = ExceptionState(values[value], values[type], lineno)
+        return call_state
+
     def _states_for_line(self, lineno):
         states = []
-        for var in self.var_states:
-            var_states = ''
-            if var != 'self':
-                call_state = self.var_states[var]
-                for state in call_state.states:
-                    if state.inline == lineno:
-                        if str(state) not in var_states and state.value_has_changed:
-                            var_states += str(state) + ' '
-            if var_states:
-                states.append(var_states.strip())
+        for changed_states in self._changed_states_by_line().get(lineno, {}).values():
+            # Distinct states, in order
+            var_states = dict.fromkeys(str(state) for state in changed_states)
+            states.append(' '.join(var_states).strip())
         return states
 
-    def _save_arg_states(self, argvalues, lineno):
-        for arg in argvalues.args:
-            obj = argvalues.locals[arg]
-            arg_state = ArgState(arg, obj_value(obj), obj_type(obj), lineno)
-            self.arg_states.append(arg_state)
-
-        if argvalues.varargs:
-            obj = argvalues.locals[argvalues.varargs]
-            arg_state = ArgState(argvalues.varargs, obj_value(obj), obj_type(obj), lineno)
-            self.arg_states.append(arg_state)
-
-        if argvalues.keywords:
-            obj = argvalues.locals[argvalues.keywords]
-            arg_state = ArgState(argvalues.keywords, obj_value(obj), obj_type(obj), lineno)
-            self.arg_states.append(arg_state)
-
-    def _save_var_states(self, argvalues, lineno, inline):
-        for arg in argvalues.locals:
-            obj = argvalues.locals[arg]
-            value = obj_value(obj)
-            type = obj_type(obj)
-            self._save_var_state(name=arg, value=value, type=type, lineno=lineno, inline=inline)
+    def _changed_states_by_line(self):
+        # Changed var states (but self) by the line that changed them (their inline) and by var,
+        # built on the first lookup after new states are saved
+        if self.line_states is None:
+            line_states = {}
+            for name, var_state in self.var_states.items():
+                if name == 'self':
+                    continue
+                for state in var_state.states:
+                    if state.value_has_changed:
+                        line_states.setdefault(state.inline, {}).setdefault(name, []).append(state)
+            self.line_states = line_states
+        return self.line_states
+
+    def _save_arg_state(self, name, value, type, lineno):
+        self.arg_states.append(ArgState(name, value, type, lineno))
 
     def _save_var_state(self, name, value, type, lineno, inline):
-        self.var_states[name] = self.var_states.get(name, VarStateHistory(name, []))
-        self.var_states[name]._add_var_state(name, value, type, lineno, inline)
+        self.line_states = None
+        var_state = self.var_states.get(name)
+        if var_state is None:
+            var_state = self.var_states[name] = VarStateHistory(name)
+        var_state._add_var_state(name, value, type, lineno, inline)
+
+    def _save_changed_var_state(self, name, value, type, lineno, inline):
+        var_state = self.var_states.get(name)
+        if var_state is None or var_state._detect_value_has_changed(value):
+            self._save_var_state(name, value, type, lineno, inline)
 
     def _save_yield_state(self, value, type, lineno):
         self.yield_states.append(YieldState(value, type, lineno))
@@ -385,45 +661,63 @@ class CallState:
 
 class VarStateHistory:
 
-    def __init__(self, name, states):
+    # States of a variable in a call, stored by column: values and types (shared through the value pool),
+    # lines in arrays of ints and whether the value changed in a bytearray, so that a state takes about
+    # 25 bytes. VarState objects are only built when the states are read
+
+    __slots__ = ('name', 'values', 'types', 'linenos', 'inlines', 'changes')
+
+    def __init__(self, name, states=()):
         self.name = name
-        self.states = states
+        self.values = []
+        self.types = []
+        self.linenos = array('i')
+        self.inlines = array('i')
+        self.changes = bytearray()
+        for state in states:
+            self._append(state.value, state.type, state.lineno, state.inline, state.value_has_changed)
+
+    @property
+    def states(self):
+        return VarStates(self)
 
     def get_last_state(self):
         return self.states[-1]
 
     def first_last_state(self):
-        if len(self.states) == 1:
-            return self.states[0], self.states[0]
-        return self.states[0], self.states[-1]
+        states = self.states
+        return states[0], states[-1]
 
     def distinct_values(self):
-        values = {}
-        for state in self.states:
-            if state.value not in values:
-                values[state.value] = None
-        return values.keys()
+        return dict.fromkeys(self.values).keys()
 
     def distinct_sequential_values(self):
         values = []
         b = None
-        for state in self.states:
-            if state.value != b:
-                values.append(state.value)
-            b = state.value
+        for value in self.values:
+            if value != b:
+                values.append(value)
+            b = value
         return values
 
     def _add_var_state(self, name, value, type, lineno, inline):
-        value_has_changed = self._detect_value_has_changed(value)
-        new_state = VarState(name, value, type, lineno, inline, value_has_changed)
-        self.states.append(new_state)
+        self._append(value, type, lineno, inline, self._detect_value_has_changed(value))
+
+    def _append(self, value, type, lineno, inline, value_has_changed):
+        self.values.append(value)
+        self.types.append(type)
+        self.linenos.append(lineno)
+        self.inlines.append(inline)
+        self.changes.append(value_has_changed)
 
     def _detect_value_has_changed(self, new_value):
-        if not self.states:
+        if not self.values:
             return True
-        last_state = self.get_last_state()
+        last_value = self.values[-1]
+        if last_value is new_value:
+            return False
         try:
-            if last_state.value != new_value:
+            if last_value != new_value:
                 return True
             return False
         except Exception as e:
@@ -435,8 +729,44 @@ class VarStateHistory:
         return f'{self.name}: {values_str}'
 
 
+class VarStates(Sequence):
+
+    # Read-only list of the states of a VarStateHistory, built from its columns
+
+    __slots__ = ('history',)
+
+    def __init__(self, history):
+        self.history = history
+
+    def __len__(self):
+        return len(self.history.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[each] for each in range(*index.indices(len(self)))]
+        history = self.history
+        return VarState(history.name, history.values[index], history.types[index], history.linenos[index],
+                        history.inlines[index], bool(history.changes[index]))
+
+    def __iter__(self):
+        history = self.history
+        for value, type, lineno, inline, changed in zip(history.values, history.types, history.linenos,
+                                                        history.inlines, history.changes):
+            yield VarState(history.name, value, type, lineno, inline, bool(changed))
+
+    def __eq__(self, other):
+        return list(self) == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class State:
 
+    __slots__ = ('value', 'type', 'lineno')
+
     def __init__(self, value, type, lineno):
         self.value = value
         self.type = type
@@ -448,6 +778,8 @@ class State:
 
 class VarState(State):
 
+    __slots__ = ('name', 'inline', 'value_has_changed')
+
     def __init__(self, name, value, type, lineno, inline, value_has_changed=False):
         super().__init__(value, type, lineno)
         self.name = name
@@ -460,6 +792,8 @@ class VarState(State):
 
 class ArgState(State):
 
+    __slots__ = ('name',)
+
     def __init__(self, name, value, type, lineno):
         super().__init__(value, type, lineno)
         self.name = name
@@ -471,6 +805,8 @@ class ArgState(State):
 
 class ReturnState(State):
 
+    __slots__ = ()
+
     def __init__(self, value, type, lineno=0):
         super().__init__(value, type, lineno)
 
@@ -483,6 +819,8 @@ class ReturnState(State):
 
 class YieldState(State):
 
+    __slots__ = ()
+
     def __init__(self, value, type, lineno=0):
         super().__init__(value, type, lineno)
 
@@ -495,6 +833,8 @@ class YieldState(State):
 
 class ExceptionState(State):
 
+    __slots__ = ()
+
     def __init__(self, value, type, lineno=0):
         super().__init__(value, type, lineno)
 
@@ -0,0 +1,214 @@
+import os
+import glob
+import json
+import atexit
+import random
+import socket
+import multiprocessing
+import multiprocessing.process
+from spotflow.collector import Collector
+from spotflow.model import MonitoredProgram
+from spotflow import static_analysis
+from spotflow.utils import find_full_name
+
+# Child processes (multiprocessing, concurrent.futures and python subprocesses) get the settings of the collector
+# in an environment variable, start a collector of their own and save their result as a shard when they exit.
+# Shards are merged into the result of the parent, like the parallel mode of coverage.py.
+
+DEFAULT_SHARDS_DIR = '.spotflow'
+PROCESS_START_ENV = 'SPOTFLOW_PROCESS_START'
+SHARD_PATTERN = 'spotflow.*.shard'
+
+# Directory with the sitecustomize module that starts the collector in python subprocesses
+BOOTSTRAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bootstrap')
+
+COLLECTOR_SETTINGS = ['method_names', 'file_names', 'ignore_files', 'tracer', 'collect_arg_states',
+                      'collect_return_states', 'collect_yield_states', 'collect_exception_states',
+                      'collect_var_states', 'buffer_capacity', 'buffer_overflow']
+VALUE_LIMITS = ['max_items', 'max_depth', 'max_string', 'max_length', 'time_budget']
+
+PATCHED_MARKER = '_spotflow_patched'
+original_bootstrap = multiprocessing.process.BaseProcess._bootstrap
+original_get_preparation_data = None
+
+# Collector monitoring this process and the pid it was started in: forked children inherit the collector
+# of their parent, which must be stopped. Only children have a shards dir, where their result is saved.
+process_collector = None
+process_pid = None
+process_shards_dir = None
+saved_environ = {}
+
+
+def collector_config(collector, shards_dir):
+    config = {name: getattr(collector, name) for name in COLLECTOR_SETTINGS}
+    # Targets may be functions, which children find by name
+    for name in ('method_names', 'file_names', 'ignore_files'):
+        if config[name] is not None:
+            config[name] = [each if isinstance(each, str) else find_full_name(each) for each in config[name]]
+    config['value_limits'] = {name: getattr(collector.value_renderer, name) for name in VALUE_LIMITS}
+    config['shards_dir'] = shards_dir
+    analysis_cache = static_analysis.analysis_cache
+    config['analysis_cache_dir'] = analysis_cache.directory if analysis_cache else None
+    return config
+
+
+def build_collector(config):
+    collector = Collector()
+    for name in COLLECTOR_SETTINGS:
+        setattr(collector, name, config[name])
+    collector.value_renderer.set_limits(**config['value_limits'])
+    if config['analysis_cache_dir']:
+        static_analysis.use_analysis_cache(static_analysis.AnalysisCache(config['analysis_cache_dir']))
+    return collector
+
+
+def start_parallel(collector, shards_dir):
+    global process_collector, process_pid, process_shards_dir, saved_environ
+
+    os.makedirs(shards_dir, exist_ok=True)
+    saved_environ = {name: os.environ.get(name) for name in (PROCESS_START_ENV, 'PYTHONPATH')}
+
+    os.environ[PROCESS_START_ENV] = json.dumps(collector_config(collector, shards_dir))
+    python_path = [BOOTSTRAP_DIR]
+    if saved_environ['PYTHONPATH']:
+        python_path.append(saved_environ['PYTHONPATH'])
+    os.environ['PYTHONPATH'] = os.pathsep.join(python_path)
+    patch_multiprocessing()
+
+    process_collector, process_pid, process_shards_dir = collector, os.getpid(), None
+
+
+def stop_parallel():
+    global process_collector, process_pid
+
+    # Children started afterwards are not monitored
+    for name, value in saved_environ.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    saved_environ.clear()
+    unpatch_multiprocessing()
+    process_collector, process_pid = None, None
+
+
+def start_child():
+    global process_collector, process_pid, process_shards_dir
+
+    if process_collector and process_pid == os.getpid():
+        # Eg, spawned processes are already monitored since the interpreter started
+        return process_collector
+    if process_collector:
+        process_collector.py_tracer.stop_tracer()
+        process_collector = None
+
+    config = os.environ.get(PROCESS_START_ENV)
+    if not config:
+        return None
+    config = json.loads(config)
+
+    collector = build_collector(config)
+    process_collector, process_pid, process_shards_dir = collector, os.getpid(), config['shards_dir']
+    patch_multiprocessing()
+    atexit.register(stop_child)
+    collector.start()
+    return collector
+
+
+def stop_child():
+    global process_collector
+
+    if process_collector is None or process_pid != os.getpid() or process_shards_dir is None:
+        return
+    collector, process_collector = process_collector, None
+    collector.stop()
+    if len(collector.monitored_program):
+        save_shard(collector.monitored_program, process_shards_dir)
+
+
+def save_shard(monitored_program, shards_dir):
+    name = f'spotflow.{socket.gethostname()}.{os.getpid()}.{random.randint(0, 999999):06d}.shard'
+    path = os.path.join(shards_dir, name)
+    # Shards are only seen by the parent once they are completely written. They are the JSON of the plain data
+    # of the program, so that loading them does not run code
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(monitored_program.to_data(), f)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_shards(shards_dir):
+    programs = []
+    for path in sorted(glob.glob(os.path.join(shards_dir, SHARD_PATTERN)), key=os.path.getmtime):
+        try:
+            with open(path, encoding='utf-8') as f:
+                programs.append(MonitoredProgram.from_data(json.load(f)))
+        except (ValueError, TypeError, KeyError):
+            # Eg, shards of older versions
+            continue
+        os.remove(path)
+    return programs
+
+
+class ProcessWithSpotFlow(multiprocessing.process.BaseProcess):
+
+    def _bootstrap(self, *args, **kwargs):
+        collector = start_child()
+        try:
+            return original_bootstrap(self, *args, **kwargs)
+        finally:
+            # Processes of multiprocessing exit with os._exit, which does not run atexit
+            if collector:
+                stop_child()
+
+
+class Stowaway:
+
+    # Pickled with the preparation data of spawned processes, so that unpickling it patches their multiprocessing
+
+    def __getstate__(self):
+        # A falsy state would not be passed to __setstate__
+        return {'patch': True}
+
+    def __setstate__(self, state):
+        patch_multiprocessing()
+
+
+def patch_multiprocessing():
+    global original_get_preparation_data
+
+    if hasattr(multiprocessing, PATCHED_MARKER):
+        return
+
+    multiprocessing.process.BaseProcess._bootstrap = ProcessWithSpotFlow._bootstrap
+
+    try:
+        from multiprocessing import spawn
+        get_preparation_data = spawn.get_preparation_data
+    except (ImportError, AttributeError):
+        pass
+    else:
+        def get_preparation_data_with_stowaway(name):
+            data = get_preparation_data(name)
+            data['stowaway'] = Stowaway()
+            return data
+
+        spawn.get_preparation_data = get_preparation_data_with_stowaway
+        original_get_preparation_data = get_preparation_data
+
+    setattr(multiprocessing, PATCHED_MARKER, True)
+
+
+def unpatch_multiprocessing():
+    global original_get_preparation_data
+
+    if not hasattr(multiprocessing, PATCHED_MARKER):
+        return
+
+    multiprocessing.process.BaseProcess._bootstrap = original_bootstrap
+    if original_get_preparation_data:
+        from multiprocessing import spawn
+        spawn.get_preparation_data = original_get_preparation_data
+        original_get_preparation_data = None
+
+    delattr(multiprocessing, PATCHED_MARKER)
@@ -0,0 +1,310 @@
+import time
+import zlib
+from itertools import islice
+
+DEFAULT_MAX_ITEMS = 100
+DEFAULT_MAX_DEPTH = 6
+DEFAULT_MAX_STRING = 1000
+DEFAULT_MAX_LENGTH = 5000
+
+ELLIPSIS = '...'
+SEPARATOR = ', '
+
+# Types are classified by name, so that classes with the same name (eg, from C extensions) are formatted alike
+DEFINITION_TYPES = frozenset(['type', 'module', 'function', 'method', 'code', 'traceback', 'frame', 'generator',
+                              'coroutine'])
+BASIC_TYPES = frozenset(['NoneType', 'bool', 'int', 'float', 'complex', 'str', 'range'])
+SEQUENCE_TYPES = frozenset(['list', 'tuple'])
+SET_TYPES = frozenset(['set', 'frozenset'])
+MAP_TYPES = frozenset(['dict'])
+BUFFER_TYPES = frozenset(['bytes', 'bytearray', 'memoryview'])
+
+# Items rendered by repr() in C when a container only has them: their repr is short and the same as render_value's
+FLOAT_TYPES = frozenset([type(None), bool, float])
+INT_TYPES = frozenset([bool, int])
+STR_TYPES = frozenset([str])
+MAX_FLOAT_REPR = 24
+
+# Buffers and arrays are summarized with a checksum of (at most) their first bytes
+CHECKSUM_BYTES = 1 << 20
+
+# Formatters registered by users, obj -> str, for all renderers created afterwards
+custom_formatters = {}
+
+
+class RenderBudget:
+
+    # Budget of a single value: the length of the output and, optionally, the time to render it.
+    # Once it is exhausted, the remaining items are rendered as an ellipsis
+
+    __slots__ = ('remaining', 'deadline', 'active')
+
+    def __init__(self, max_length, time_budget=None):
+        self.remaining = max_length
+        self.deadline = None if time_budget is None else time.perf_counter() + time_budget
+        self.active = set()
+
+    def is_exhausted(self):
+        if self.remaining <= 0:
+            return True
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+
+class ValueRenderer:
+
+    # Renders values like repr(), but the output is truncated like reprlib, so that rendering
+    # a large value does not depend on its size: containers show up to max_items items and
+    # max_depth nested levels, strings up to max_string characters, and the whole value about
+    # max_length characters (and time_budget seconds, if given).
+
+    # Values are formatted by the formatter of their exact type, found in a single dict lookup.
+    # Formatters of known types are resolved on their first value and then cached.
+
+    def __init__(self, max_items=DEFAULT_MAX_ITEMS, max_depth=DEFAULT_MAX_DEPTH, max_string=DEFAULT_MAX_STRING,
+                 max_length=DEFAULT_MAX_LENGTH, time_budget=None):
+        self.set_limits(max_items, max_depth, max_string, max_length, time_budget)
+
+        self.formatters = {}
+        self.renderers = {
+            list: self.render_list,
+            tuple: self.render_tuple,
+            set: self.render_set,
+            frozenset: self.render_frozenset,
+            dict: self.render_dict,
+            str: self.render_str,
+            bytes: self.render_buffer,
+            bytearray: self.render_buffer,
+            memoryview: self.render_buffer,
+            int: self.render_int,
+        }
+
+        for type_, formatter in custom_formatters.items():
+            self.register_formatter(type_, formatter)
+
+    def set_limits(self, max_items=DEFAULT_MAX_ITEMS, max_depth=DEFAULT_MAX_DEPTH, max_string=DEFAULT_MAX_STRING,
+                   max_length=DEFAULT_MAX_LENGTH, time_budget=None):
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self.max_string = max_string
+        self.max_length = max_length
+        self.time_budget = time_budget
+
+    def register_formatter(self, type_, formatter):
+        self.formatters[type_] = formatter
+        self.renderers[type_] = lambda obj, depth, budget: formatter(obj)
+
+    def value(self, obj):
+        try:
+            formatter = self.formatters.get(type(obj))
+            if formatter is None:
+                formatter = self.formatters[type(obj)] = self.resolve_formatter(type(obj))
+            return formatter(obj)
+        except Exception:
+            return type(obj).__qualname__
+
+    def resolve_formatter(self, type_):
+        name = type_.__name__
+        if name in DEFINITION_TYPES:
+            return format_definition
+        if name in BASIC_TYPES:
+            return self.render
+        if name in SEQUENCE_TYPES:
+            return self.format_sequence
+        if name in SET_TYPES:
+            return self.format_set
+        if name in MAP_TYPES:
+            return self.format_map
+        if name in BUFFER_TYPES:
+            return summarize_buffer
+        # NumPy is never imported, arrays are recognized by their type
+        if name == 'ndarray' and type_.__module__ == 'numpy':
+            return summarize_array
+        return format_class_name
+
+    # Containers are only rendered by content when their first item is basic
+
+    def format_sequence(self, obj):
+        if not obj or is_basic(obj[0]):
+            return self.render(obj)
+        return format_class_name(obj)
+
+    def format_set(self, obj):
+        for each in obj:
+            if not is_basic(each):
+                return format_class_name(obj)
+            break
+        return self.render(obj)
+
+    def format_map(self, obj):
+        for each in obj.values():
+            if not is_basic(each):
+                return format_class_name(obj)
+            break
+        return self.render(obj)
+
+    def render(self, obj):
+        budget = RenderBudget(self.max_length, self.time_budget)
+        return self.render_value(obj, 0, budget)
+
+    def render_value(self, obj, depth, budget):
+        if budget.is_exhausted():
+            return ELLIPSIS
+        renderer = self.renderers.get(type(obj), self.render_other)
+        remaining = budget.remaining
+        text = renderer(obj, depth, budget)
+        # The items of containers are already discounted
+        budget.remaining -= max(len(text) - (remaining - budget.remaining), 0)
+        return text
+
+    def render_items(self, items, size, depth, budget, render_item):
+        parts = []
+        for item in islice(items, self.max_items):
+            if budget.is_exhausted():
+                parts.append(ELLIPSIS)
+                return SEPARATOR.join(parts)
+            parts.append(render_item(item, depth + 1, budget))
+            budget.remaining -= len(SEPARATOR)
+        if size > self.max_items:
+            parts.append(ELLIPSIS)
+        return SEPARATOR.join(parts)
+
+    def render_container(self, obj, depth, budget, left, right, render_item=None, items=None):
+        if not obj:
+            return repr(obj)
+        # Recursive containers are rendered like repr()
+        if depth >= self.max_depth or id(obj) in budget.active:
+            return f'{left}{ELLIPSIS}{right}'
+        if render_item is None:
+            text = self.render_scalars(len(obj), budget, left, right, obj)
+            if text is not None:
+                return text
+        budget.active.add(id(obj))
+        try:
+            items = obj if items is None else items
+            render_item = render_item or self.render_value
+            return left + self.render_items(items, len(obj), depth, budget, render_item) + right
+        finally:
+            budget.active.discard(id(obj))
+
+    def render_scalars(self, size, budget, left, right, *columns):
+        # Fast path of render_items for containers of short scalars (and dicts of them, with a column of keys
+        # and one of values), which are rendered by repr() in C. Otherwise, or if the output would not fit
+        # the budget, it returns None and the items are rendered one by one
+        columns = [list(islice(column, self.max_items)) for column in columns]
+        if not all(map(self.are_short_scalars, columns)):
+            return None
+        if len(columns) == 1:
+            parts = list(map(repr, columns[0]))
+        else:
+            parts = list(map('{}: {}'.format, map(repr, columns[0]), map(repr, columns[1])))
+        if size > self.max_items:
+            parts.append(ELLIPSIS)
+        text = left + SEPARATOR.join(parts) + right
+        return text if len(text) <= budget.remaining else None
+
+    def are_short_scalars(self, items):
+        types = set(map(type, items))
+        if types <= FLOAT_TYPES:
+            return self.max_string >= MAX_FLOAT_REPR
+        if types <= INT_TYPES:
+            return max(map(int.bit_length, items)) <= self.max_string * 3
+        if types == STR_TYPES:
+            return max(map(len, items)) <= self.max_string
+        return False
+
+    def render_list(self, obj, depth, budget):
+        return self.render_container(obj, depth, budget, '[', ']')
+
+    def render_tuple(self, obj, depth, budget):
+        if len(obj) == 1:
+            return self.render_container(obj, depth, budget, '(', ',)')
+        return self.render_container(obj, depth, budget, '(', ')')
+
+    def render_set(self, obj, depth, budget):
+        return self.render_container(obj, depth, budget, '{', '}')
+
+    def render_frozenset(self, obj, depth, budget):
+        return self.render_container(obj, depth, budget, 'frozenset({', '})')
+
+    def render_dict(self, obj, depth, budget):
+        if obj and depth < self.max_depth:
+            text = self.render_scalars(len(obj), budget, '{', '}', obj, obj.values())
+            if text is not None:
+                return text
+        return self.render_container(obj, depth, budget, '{', '}', self.render_dict_item, obj.items())
+
+    def render_dict_item(self, item, depth, budget):
+        key, value = item
+        return f'{self.render_value(key, depth, budget)}: {self.render_value(value, depth, budget)}'
+
+    def render_str(self, obj, depth, budget):
+        if len(obj) > self.max_string:
+            return repr(obj[:self.max_string]) + ELLIPSIS
+        return repr(obj)
+
+    def render_buffer(self, obj, depth, budget):
+        return summarize_buffer(obj)
+
+    def render_int(self, obj, depth, budget):
+        # Converting a huge int to decimal is quadratic, so only its size is rendered
+        if obj.bit_length() > self.max_string * 3:
+            return f'<int of {obj.bit_length()} bits>'
+        return repr(obj)
+
+    def render_other(self, obj, depth, budget):
+        try:
+            text = repr(obj)
+        except Exception:
+            return type(obj).__qualname__
+        if len(text) > self.max_string:
+            return text[:self.max_string] + ELLIPSIS
+        return text
+
+
+def is_basic(obj):
+    return type(obj).__name__ in BASIC_TYPES
+
+
+def format_definition(obj):
+    return f'{obj.__qualname__} def'
+
+
+def format_class_name(obj):
+    return obj.__class__.__qualname__
+
+
+def summarize_buffer(obj):
+    view = memoryview(obj)
+    return f'{type(obj).__qualname__}(len={view.nbytes}{checksum(view)})'
+
+
+def summarize_array(obj):
+    summary = f'ndarray(shape={obj.shape}, dtype={obj.dtype}, nbytes={obj.nbytes}'
+    try:
+        view = memoryview(obj)
+    except (TypeError, ValueError):
+        # Eg, arrays of objects do not expose their buffer
+        return summary + ')'
+    return summary + checksum(view) + ')'
+
+
+def checksum(view):
+    # Zero-copy: the checksum reads the buffer through a byte view of it
+    if not view.c_contiguous:
+        return ''
+    try:
+        data = view.cast('B') if view.ndim != 1 or view.format != 'B' else view
+    except (TypeError, ValueError):
+        # Buffers whose format cannot be cast are summarized without checksum
+        return ''
+    if data.nbytes > CHECKSUM_BYTES:
+        return f', prefix_crc32={zlib.crc32(data[:CHECKSUM_BYTES]):#010x}'
+    return f', crc32={zlib.crc32(data):#010x}'
+
+
+def register_formatter(type_, formatter):
+    custom_formatters[type_] = formatter
+    default_renderer.register_formatter(type_, formatter)
+
+
+default_renderer = ValueRenderer()
@@ -0,0 +1,129 @@
+import io
+import time
+import pickle
+import tempfile
+import threading
+from itertools import count
+from collections import deque
+
+# Buffered mode: the monitored threads only push their events into a preallocated ring of slots, and a background
+# thread takes them out and does the rest of the work (eg, rendering the values of the states). Pushing takes no
+# lock: next() of a count is atomic, so each event gets a slot of its own, and only the consumer frees slots.
+
+BLOCK, DROP, SPILL = 'block', 'drop', 'spill'
+OVERFLOWS = (BLOCK, DROP, SPILL)
+DEFAULT_CAPACITY = 65536
+POLL_INTERVAL = 0.001
+
+
+class Rendered(tuple):
+
+    # Value and type of a value that is already rendered, eg, the values of spilled events
+
+    pass
+
+
+class RingBuffer:
+
+    # Events are tuples whose last item is a dict of values. When the ring is full, the producers wait for the
+    # consumer (block), skip the event and count it (drop), or render its values with spill_values and write them
+    # to a temporary file (spill). Once events are spilled, the next ones are spilled too until the consumer
+    # reads them back, so that the events of a thread keep their order.
+
+    def __init__(self, consume, capacity=DEFAULT_CAPACITY, overflow=BLOCK, spill_values=None):
+        if overflow not in OVERFLOWS:
+            raise ValueError(f'overflow must be one of {OVERFLOWS}, not {overflow!r}')
+        self.consume = consume
+        self.capacity = capacity
+        self.overflow = overflow
+        self.spill_values = spill_values
+        self.slots = [None] * capacity
+        self.positions = count()
+        self.write_position = 0
+        self.read_position = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.spill_lock = threading.Lock()
+        self.spill_heads = deque()
+        self.spill_file = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        # The tracers ignore the consumer (see Collector.ignored_threads), which may run target code when rendering
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='spotflow-consumer', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        # Returns once every pushed event is consumed
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.spill_file:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def push(self, event):
+        if self.overflow != BLOCK and (self.spill_heads or self.write_position - self.read_position >= self.capacity):
+            if self.overflow == DROP:
+                self.dropped += 1
+            else:
+                self.spill(event)
+            return
+
+        position = next(self.positions)
+        self.write_position = position + 1
+        slot = position % self.capacity
+        while self.slots[slot] is not None:
+            time.sleep(POLL_INTERVAL)
+        self.slots[slot] = event
+
+    def spill(self, event):
+        values = pickle.dumps(self.spill_values(event[-1]))
+        with self.spill_lock:
+            if self.spill_file is None:
+                self.spill_file = tempfile.TemporaryFile(prefix='spotflow-spill-')
+            self.spill_file.write(values)
+            self.spill_heads.append(event[:-1])
+            self.spilled += 1
+
+    def run(self):
+        while True:
+            # Producers are stopped before the consumer, so nothing is pushed after a drain that finds no events
+            running = self.running
+            if not self.drain():
+                if not running:
+                    return
+                time.sleep(POLL_INTERVAL)
+
+    def drain(self):
+        consumed = 0
+        slots = self.slots
+        while True:
+            slot = self.read_position % self.capacity
+            event = slots[slot]
+            if event is None:
+                break
+            self.consume(event)
+            slots[slot] = None
+            self.read_position += 1
+            consumed += 1
+        if self.spill_heads:
+            consumed += self.drain_spill()
+        return consumed
+
+    def drain_spill(self):
+        with self.spill_lock:
+            heads, self.spill_heads = self.spill_heads, deque()
+            self.spill_file.seek(0)
+            data = self.spill_file.read()
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+        # Each record is a pickle of its own, whose memo is not shared with the others
+        stream = io.BytesIO(data)
+        for head in heads:
+            self.consume(head + (pickle.load(stream),))
+        return len(heads)
+
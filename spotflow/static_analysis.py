@@ -0,0 +1,262 @@
+import os
+import sys
+import ast
+import dis
+import json
+import hashlib
+import linecache
+from contextlib import contextmanager
+from spotflow.utils import find_executable_linenos, get_html_lines
+
+file_analysis_cache = {}
+store_lines_cache = {}
+
+# Persistent cache of the analysis, off by default (see SpotFlow.analysis_cache)
+DEFAULT_CACHE_DIR = '.spotflow_cache'
+# Changed when the analysis changes, so that older entries are not read
+CACHE_VERSION = 3
+analysis_cache = None
+
+# Instructions that rebind or unbind a local variable of the running frame
+STORE_OPNAMES = {'STORE_FAST', 'DELETE_FAST', 'STORE_DEREF', 'DELETE_DEREF',
+                 'STORE_FAST_MAYBE_NULL', 'STORE_FAST_STORE_FAST', 'STORE_FAST_LOAD_FAST'}
+
+
+class FileAnalysis:
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        self.return_lines = set()
+        self.yield_lines = set()
+        self.control_flow_lines = set()
+        self.raise_lines = set()
+        self.raise_names = {}
+        self.super_call_lines = set()
+        # First line of each definition (its first decorator or header line) -> line of the first statement
+        self.definition_bodies = {}
+        self.docstring_lines = set()
+        self.executable_lines = {}
+
+    def to_data(self):
+        return {
+            'return_lines': sorted(self.return_lines),
+            'yield_lines': sorted(self.yield_lines),
+            'control_flow_lines': sorted(self.control_flow_lines),
+            'raise_lines': sorted(self.raise_lines),
+            'raise_names': sorted(self.raise_names.items()),
+            'super_call_lines': sorted(self.super_call_lines),
+            'definition_bodies': sorted(self.definition_bodies.items()),
+            'docstring_lines': sorted(self.docstring_lines),
+            'executable_lines': sorted(self.executable_lines),
+        }
+
+    @staticmethod
+    def from_data(filename, data):
+        analysis = FileAnalysis(filename)
+        analysis.return_lines = set(data['return_lines'])
+        analysis.yield_lines = set(data['yield_lines'])
+        analysis.control_flow_lines = set(data['control_flow_lines'])
+        analysis.raise_lines = set(data['raise_lines'])
+        analysis.raise_names = dict(data['raise_names'])
+        analysis.super_call_lines = set(data['super_call_lines'])
+        analysis.definition_bodies = dict(data['definition_bodies'])
+        analysis.docstring_lines = set(data['docstring_lines'])
+        analysis.executable_lines = dict.fromkeys(data['executable_lines'], 1)
+        return analysis
+
+    def analyze(self, source):
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            return self
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Return):
+                self.return_lines.update(node_lines(node))
+            elif isinstance(node, (ast.Yield, ast.YieldFrom)):
+                self.yield_lines.update(node_lines(node))
+            elif isinstance(node, (ast.If, ast.While, ast.For, ast.AsyncFor)):
+                # Only the header, elif is an If node in the orelse of another If
+                self.control_flow_lines.add(node.lineno)
+            elif isinstance(node, ast.Raise):
+                self.raise_lines.update(node_lines(node))
+                name = raised_name(node)
+                if name:
+                    self.raise_names.update(dict.fromkeys(node_lines(node), name))
+            elif is_super_call(node):
+                self.super_call_lines.update(node_lines(node))
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                self.add_definition(node)
+        return self
+
+    def add_definition(self, node):
+        # Decorators and header, up to the first statement of the body (which may be in the header line)
+        first_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        self.definition_bodies[first_line] = node.body[0].lineno
+        if ast.get_docstring(node, clean=False) is not None:
+            self.docstring_lines.update(node_lines(node.body[0]))
+
+
+def node_lines(node):
+    # Multi-line statements and expressions may report events in any of their lines
+    end_lineno = getattr(node, 'end_lineno', None) or node.lineno
+    return range(node.lineno, end_lineno + 1)
+
+
+def raised_name(node):
+    # Dotted name of the raised exception (or of its class, if it is instantiated)
+    exc = node.exc.func if isinstance(node.exc, ast.Call) else node.exc
+    names = []
+    while isinstance(exc, ast.Attribute):
+        names.append(exc.attr)
+        exc = exc.value
+    if not isinstance(exc, ast.Name):
+        return None
+    names.append(exc.id)
+    return '.'.join(reversed(names))
+
+
+def is_super_call(node):
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'super'
+
+
+class AnalysisCache:
+
+    # Analysis of files (and highlighted code) saved in a directory, like __pycache__, so that runs on unchanged
+    # files skip it. Entries of files are found by path and checked by mtime and size, or by content hash when
+    # these changed (eg, after a checkout). Entries are per Python version, whose compilers find other lines.
+    # Entries are JSON, so that reading the cache of an untrusted checkout does not run any code
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.suffix = f'.{sys.implementation.cache_tag}.{CACHE_VERSION}.json'
+
+    def path(self, key):
+        return os.path.join(self.directory, digest(key.encode('utf-8', 'surrogatepass')) + self.suffix)
+
+    def load(self, key):
+        try:
+            with open(self.path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, value):
+        path = self.path(key)
+        # Entries are only seen once completely written, also by other processes
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    def load_analysis(self, filename):
+        entry = self.load(os.path.abspath(filename))
+        try:
+            mtime, size, content_hash, data = entry
+            stat = os.stat(filename)
+            if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                if stat.st_size != size or file_digest(filename) != content_hash:
+                    return None
+                self.save(os.path.abspath(filename), [stat.st_mtime_ns, size, content_hash, data])
+            return FileAnalysis.from_data(filename, data)
+        except (OSError, TypeError, ValueError, KeyError):
+            # No entry, a file that is not on disk, or an entry that is not an analysis
+            return None
+
+    def save_analysis(self, filename, analysis):
+        try:
+            # Files that are not on disk (eg, <string>) are not saved
+            stat = os.stat(filename)
+            content_hash = file_digest(filename)
+        except OSError:
+            return
+        self.save(os.path.abspath(filename), [stat.st_mtime_ns, stat.st_size, content_hash, analysis.to_data()])
+
+
+def digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def file_digest(filename):
+    with open(filename, 'rb') as f:
+        return digest(f.read())
+
+
+def use_analysis_cache(cache):
+    # Sets the cache of analyze_file and html_lines_for_code (None for no cache), and returns the previous one
+    global analysis_cache
+    previous, analysis_cache = analysis_cache, cache
+    return previous
+
+
+@contextmanager
+def using_analysis_cache(cache):
+    previous = use_analysis_cache(cache)
+    try:
+        yield
+    finally:
+        use_analysis_cache(previous)
+
+
+def analyze_file(filename, module_globals=None):
+    if filename not in file_analysis_cache:
+        analysis = analysis_cache.load_analysis(filename) if analysis_cache else None
+        if analysis is None:
+            source = ''.join(linecache.getlines(filename, module_globals))
+            analysis = FileAnalysis(filename).analyze(source)
+            # Python 3.13 may map instructions without a line to None
+            analysis.executable_lines = {line: 1 for line in find_executable_linenos(filename) if line is not None}
+            if analysis_cache:
+                analysis_cache.save_analysis(filename, analysis)
+        file_analysis_cache[filename] = analysis
+    return file_analysis_cache[filename]
+
+
+def html_lines_for_code(code):
+    if not analysis_cache:
+        return get_html_lines(code)
+    # Highlighted code is found by its content, so it is never stale
+    key = 'html:' + digest(code.encode('utf-8', 'surrogatepass'))
+    html_lines = analysis_cache.load(key)
+    if not isinstance(html_lines, list):
+        html_lines = get_html_lines(code)
+        analysis_cache.save(key, html_lines)
+    return html_lines
+
+
+def analysis_for_frame(frame):
+    return analyze_file(frame.f_code.co_filename, frame.f_globals)
+
+
+def store_lines(code):
+    # Maps each line of the code to the local variables it may rebind
+    if code not in store_lines_cache:
+        store_lines_cache[code] = find_store_lines(code)
+    return store_lines_cache[code]
+
+
+def find_store_lines(code):
+    local_names = code.co_varnames + code.co_cellvars + code.co_freevars
+    line_starts = dict(dis.findlinestarts(code))
+    stores = {}
+    lineno = None
+    for instruction in dis.get_instructions(code):
+        lineno = line_starts.get(instruction.offset, lineno)
+        if instruction.opname in STORE_OPNAMES:
+            stores.setdefault(lineno, set()).update(stored_names(instruction))
+
+    # Keep the order of the locals, as in frame.f_locals
+    return {lineno: tuple(sorted(names, key=local_names.index)) for lineno, names in stores.items()}
+
+
+def stored_names(instruction):
+    if instruction.opname == 'STORE_FAST_STORE_FAST':
+        return instruction.argval
+    if instruction.opname == 'STORE_FAST_LOAD_FAST':
+        return instruction.argval[:1]
+    return (instruction.argval,)
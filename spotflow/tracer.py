@@ -1,32 +1,245 @@
 import sys
+import threading
+from threading import get_ident
+
+
+# Since Python 3.12, threads that are already running can be traced too.
+# Before, only the current thread and the threads started afterwards are traced.
+def settrace_all_threads(func):
+    if hasattr(threading, 'settrace_all_threads'):
+        threading.settrace_all_threads(func)
+    else:
+        threading.settrace(func)
+        sys.settrace(func)
+
+
+def setprofile_all_threads(func):
+    if hasattr(threading, 'setprofile_all_threads'):
+        threading.setprofile_all_threads(func)
+    else:
+        threading.setprofile(func)
+        sys.setprofile(func)
 
 
 class PyTracer:
 
+    TRACES_LINES = True
+
     def __init__(self, collector):
         self.collector = collector
+        self.stopped = False
 
     def start_tracer(self):
-        sys.settrace(self._global_trace)
+        self.stopped = False
+        settrace_all_threads(self._global_trace)
 
     def stop_tracer(self):
-        sys.settrace(None)
+        self.stopped = True
+        settrace_all_threads(None)
 
     def _global_trace(self, frame, event, arg):
+        # The global trace function is only called on 'call' events. Frames that cannot
+        # contribute to a target method get no local trace function, so their lines,
+        # returns and exceptions are not traced at all.
+        if self.stopped or get_ident() in self.collector.ignored_threads:
+            # Before Python 3.12, other running threads keep the trace function after stop.
+            # Ignored threads drop it on their first call
+            sys.settrace(None)
+            return None
+        if event == 'call':
+            if not self.collector.is_target_frame(frame):
+                return None
+            self.collector.monitor_event(frame, event, arg)
+            return self._local_trace
 
-        if event in ('call', 'line', 'return', 'exception'):
+    def _local_trace(self, frame, event, arg):
 
+        if event in ('line', 'return', 'exception'):
             self.collector.monitor_event(frame, event, arg)
 
-            return self._global_trace
+        return self._local_trace
+
+
+# Tracer based on sys.monitoring (PEP 669), available since Python 3.12.
+# Only PY_START is enabled globally: local events (lines, returns, yields) are turned on
+# just for the code objects of target methods, and other code locations are disabled on
+# their first start. The collector receives the same events it receives from PyTracer.
+# Events are reported in all threads, including the ones that are already running, so the events
+# of ignored threads are dropped in the callbacks.
+class MonitoringTracer:
+
+    TOOL_NAME = 'spotflow'
+    TRACES_LINES = True
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.tool_id = None
+        self.target_codes = set()
+        self.offset_lines = {}
+
+    @staticmethod
+    def is_available():
+        return hasattr(sys, 'monitoring')
+
+    def start_tracer(self):
+        monitoring = sys.monitoring
+        events = monitoring.events
+
+        self.tool_id = self._free_tool_id()
+        monitoring.use_tool_id(self.tool_id, self.TOOL_NAME)
+
+        monitoring.register_callback(self.tool_id, events.PY_START, self._py_start)
+        monitoring.register_callback(self.tool_id, events.PY_RESUME, self._py_resume)
+        monitoring.register_callback(self.tool_id, events.LINE, self._line)
+        monitoring.register_callback(self.tool_id, events.JUMP, self._jump)
+        monitoring.register_callback(self.tool_id, events.PY_RETURN, self._py_return)
+        monitoring.register_callback(self.tool_id, events.PY_YIELD, self._py_return)
+        monitoring.register_callback(self.tool_id, events.PY_UNWIND, self._py_unwind)
+        monitoring.register_callback(self.tool_id, events.RAISE, self._raise)
+
+        # Locations disabled in a previous run must be seen again
+        monitoring.restart_events()
+        # RAISE and PY_UNWIND cannot be local events, so they are filtered by code in the callbacks
+        monitoring.set_events(self.tool_id, events.PY_START | events.RAISE | events.PY_UNWIND)
+
+    def stop_tracer(self):
+        if self.tool_id is None:
+            return
+        monitoring = sys.monitoring
+        events = monitoring.events
+
+        monitoring.set_events(self.tool_id, events.NO_EVENTS)
+        for code in self.target_codes:
+            monitoring.set_local_events(self.tool_id, code, events.NO_EVENTS)
+        for event in (events.PY_START, events.PY_RESUME, events.LINE, events.JUMP, events.PY_RETURN,
+                      events.PY_YIELD, events.PY_UNWIND, events.RAISE):
+            monitoring.register_callback(self.tool_id, event, None)
+        monitoring.free_tool_id(self.tool_id)
+
+        self.tool_id = None
+        self.target_codes = set()
+        self.offset_lines = {}
+
+    def _free_tool_id(self):
+        monitoring = sys.monitoring
+        for tool_id in (monitoring.PROFILER_ID, monitoring.OPTIMIZER_ID, 3, 4, 5):
+            if monitoring.get_tool(tool_id) is None:
+                return tool_id
+        raise RuntimeError('No free sys.monitoring tool id available')
+
+    def _enable_code(self, code):
+        events = sys.monitoring.events
+        local_events = events.LINE | events.JUMP | events.PY_RETURN | events.PY_YIELD | events.PY_RESUME
+        sys.monitoring.set_local_events(self.tool_id, code, local_events)
+        self.target_codes.add(code)
+
+        offset_lines = {}
+        for start, end, lineno in code.co_lines():
+            for offset in range(start, end, 2):
+                offset_lines[offset] = lineno
+        self.offset_lines[code] = offset_lines
+
+    def _py_start(self, code, instruction_offset):
+        if get_ident() in self.collector.ignored_threads:
+            return None
+        # sys._getframe(1) is the frame that triggered the event
+        frame = sys._getframe(1)
+        if code not in self.target_codes:
+            if not self.collector.is_target_frame(frame):
+                if self.collector.target_depends_on_caller(code):
+                    return None
+                return sys.monitoring.DISABLE
+            self._enable_code(code)
+        self.collector.monitor_event(frame, 'call', None)
+
+    def _py_resume(self, code, instruction_offset):
+        if get_ident() not in self.collector.ignored_threads:
+            self.collector.monitor_event(sys._getframe(1), 'call', None)
+
+    def _line(self, code, line_number):
+        if get_ident() not in self.collector.ignored_threads:
+            self.collector.monitor_event(sys._getframe(1), 'line', None)
+
+    def _jump(self, code, instruction_offset, destination_offset):
+        # Like sys.settrace, report a line event when jumping backwards to the same line (eg, loops
+        # in a single line). Jumps to other lines are already reported by LINE events.
+        if destination_offset > instruction_offset:
+            return sys.monitoring.DISABLE
+        if get_ident() in self.collector.ignored_threads:
+            return None
+        offset_lines = self.offset_lines[code]
+        if offset_lines.get(destination_offset) == offset_lines.get(instruction_offset):
+            self.collector.monitor_event(sys._getframe(1), 'line', None)
+
+    def _py_return(self, code, instruction_offset, retval):
+        if get_ident() not in self.collector.ignored_threads:
+            self.collector.monitor_event(sys._getframe(1), 'return', retval)
+
+    def _py_unwind(self, code, instruction_offset, exception):
+        if code in self.target_codes and get_ident() not in self.collector.ignored_threads:
+            self.collector.monitor_event(sys._getframe(1), 'return', None)
+
+    def _raise(self, code, instruction_offset, exception):
+        if code in self.target_codes and get_ident() not in self.collector.ignored_threads:
+            arg = type(exception), exception, exception.__traceback__
+            self.collector.monitor_event(sys._getframe(1), 'exception', arg)
+
+
+# Calls-only tracer based on sys.setprofile, which has no line events: calls have no run lines and
+# methods have no flows, but calls, call stacks, arguments, returns and exceptions are collected at
+# a fraction of the cost. Profile functions are not told which exception unwinds a frame, so it is
+# inferred from the raise statement of the frame, or from the callee the exception came from.
+class ProfileTracer:
+
+    TRACES_LINES = False
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.stopped = False
+        # Per thread: id of the frame the last unwound exception propagates to, and the exception
+        self.unwinding = {}
+
+    def start_tracer(self):
+        self.stopped = False
+        setprofile_all_threads(self._profile)
+
+    def stop_tracer(self):
+        self.stopped = True
+        setprofile_all_threads(None)
+        self.unwinding = {}
+
+    def _profile(self, frame, event, arg):
+        if self.stopped or get_ident() in self.collector.ignored_threads:
+            sys.setprofile(None)
+            return
+        if event == 'call':
+            unwinding = self.unwinding.get(get_ident())
+            if unwinding and unwinding[0] == id(frame.f_back):
+                # The exception was handled by the caller
+                del self.unwinding[get_ident()]
+            if self.collector.is_target_frame(frame):
+                self.collector.monitor_event(frame, event, arg)
+
+        elif event == 'return':
+            is_target = self.collector.is_target_frame(frame)
+            unwinding = self.unwinding.get(get_ident())
+            if is_target or (unwinding and unwinding[0] == id(frame)):
+                self._return(frame, arg, is_target, unwinding)
 
-            # filename = frame.f_globals.get('__file__', None)
-            # if filename:
-            #     modulename = trace._modname(filename)
-            #     if modulename is not None:
-            #         ignore_it = trace._Ignore().names(filename, modulename)
-            #         if not ignore_it:
-            #             return self._global_trace
-            # else:
-            #     return None
+    def _return(self, frame, arg, is_target, unwinding):
+        propagates_here = unwinding and unwinding[0] == id(frame)
+        exception = None
+        if arg is None and self.collector.is_unwinding(frame):
+            if is_target:
+                exception = self.collector.raised_exception(frame)
+            # Exceptions that are not raised by a raise statement of a known class (eg, raised by builtins) are
+            # unknown (None), and no exception state is saved
+            exception = exception or (unwinding[1] if propagates_here else None)
+            self.unwinding[get_ident()] = id(frame.f_back), exception
+        elif propagates_here:
+            del self.unwinding[get_ident()]
 
+        if is_target:
+            if exception:
+                self.collector.monitor_event(frame, 'exception', (exception, None, None))
+            self.collector.monitor_event(frame, 'return', arg)
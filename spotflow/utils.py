@@ -6,6 +6,7 @@ import trace
 import types
 import csv
 from collections import Counter
+from spotflow.render import default_renderer, DEFINITION_TYPES, BASIC_TYPES, SEQUENCE_TYPES, SET_TYPES, MAP_TYPES
 from pygments import highlight
 from pygments.lexers import get_lexer_by_name
 from pygments.formatters import get_formatter_by_name
@@ -108,33 +109,38 @@ def check_is_generator_function(func_or_method):
     return func_or_method
 
 
-def obj_value(obj):
-    try:
-        if is_definition(obj):
-            return f'{obj.__qualname__} def'
-        elif is_basic(obj) or is_safe_iterator(obj) or is_safe_set(obj) or is_safe_map(obj):
-            return repr(obj)
-        else:
-            return obj.__class__.__qualname__
-    except Exception as e:
-        return type(obj).__qualname__
+def obj_value(obj, renderer=None):
+    return (renderer or default_renderer).value(obj)
+
+
+# Flag of the types created by class statements, whose names are stored strings
+HEAP_TYPE_FLAG = 1 << 9
+
+# Names of the builtin types, which are new strings on each access
+builtin_type_names = {}
 
 
 def obj_type(obj):
-    return type(obj).__qualname__
+    # Every state has a type name, so the names of builtin types are shared instead of copied
+    obj_class = type(obj)
+    name = builtin_type_names.get(obj_class)
+    if name is None:
+        name = obj_class.__qualname__
+        if not obj_class.__flags__ & HEAP_TYPE_FLAG:
+            builtin_type_names[obj_class] = name
+    return name
 
 
 def is_definition(obj):
-    return obj.__class__.__name__ in ['type', 'module', 'function', 'method',
-                                      'code', 'traceback', 'frame', 'generator', 'coroutine']
+    return obj.__class__.__name__ in DEFINITION_TYPES
 
 
 def is_basic(obj):
-    return obj.__class__.__name__ in ['NoneType', 'bool', 'int', 'float', 'complex', 'str', 'range']
+    return obj.__class__.__name__ in BASIC_TYPES
 
 
 def is_safe_iterator(obj):
-    if obj.__class__.__name__ in ['list', 'tuple']:
+    if obj.__class__.__name__ in SEQUENCE_TYPES:
         if not obj:
             return True
         if obj and is_basic(obj[0]):
@@ -143,7 +149,7 @@ def is_safe_iterator(obj):
 
 
 def is_safe_set(obj):
-    if obj.__class__.__name__ in ['set', 'frozenset']:
+    if obj.__class__.__name__ in SET_TYPES:
         if not obj:
             return True
         for each in obj:
@@ -155,7 +161,7 @@ def is_safe_set(obj):
 
 
 def is_safe_map(obj):
-    if obj.__class__.__name__ == 'dict':
+    if obj.__class__.__name__ in MAP_TYPES:
         if not obj:
             return True
         for key in obj:
@@ -166,6 +172,24 @@ def is_safe_map(obj):
     return False
 
 
+# Values of these types never change, so a variable that keeps the same object keeps its rendered value
+IMMUTABLE_TYPES = frozenset([type(None), bool, int, float, complex, str, bytes, range])
+# Larger tuples (and frozensets) are not checked, so that the check does not depend on the size of the value
+MAX_IMMUTABLE_ITEMS = 100
+
+
+def may_change_in_place(obj):
+    # Values whose rendering may change while the variable keeps the same object: anything but immutable scalars
+    # and small tuples (or frozensets) of them, eg, containers, objects, nested tuples and values of registered
+    # formatters
+    type_ = type(obj)
+    if type_ in IMMUTABLE_TYPES:
+        return False
+    if type_ is tuple or type_ is frozenset:
+        return len(obj) > MAX_IMMUTABLE_ITEMS or not set(map(type, obj)) <= IMMUTABLE_TYPES
+    return True
+
+
 def get_html_lines(code):
     html = html_for_code(code)
     lines = []
@@ -655,3 +655,22 @@ class ClassWithExternalDependency:
     def inspect_ismethod(self):
         import inspect
         return inspect.ismethod(None)
+
+
+class AsyncCalls:
+
+    async def fetch(self, n):
+        import asyncio
+        total = 0
+        for i in range(n):
+            await asyncio.sleep(0)
+            total += i
+        return total
+
+    async def handler(self, name, n):
+        result = await self.fetch(n)
+        return f'{name}:{result}'
+
+    async def serve(self):
+        import asyncio
+        return await asyncio.gather(self.handler('a', 3), self.handler('b', 2))
@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+from tests.unit.stub_sut import AsyncCalls
+from spotflow.api import monitor, monitor_async
+
+
+class TestAsync(unittest.TestCase):
+
+    def test_interleaved_tasks(self):
+        method_name = 'tests.unit.stub_sut.AsyncCalls.fetch'
+        result = monitor_async(AsyncCalls().serve, [method_name])
+
+        calls = result[method_name].calls
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0].run_lines, [663, 664, 665, 666, 667, 665, 666, 667, 665, 666, 667, 665, 668])
+        self.assertEqual(calls[1].run_lines, [663, 664, 665, 666, 667, 665, 666, 667, 665, 668])
+        self.assertEqual(calls[0].call_state.return_state.value, '3')
+        self.assertEqual(calls[1].call_state.return_state.value, '1')
+
+        # The states of each coroutine are not mixed up, although their tasks interleave
+        self.assertEqual(calls[0].call_state.var_states['total'].distinct_sequential_values(), ['0', '1', '3'])
+        self.assertEqual(calls[1].call_state.var_states['total'].distinct_sequential_values(), ['0', '1'])
+        self.assertEqual(calls[0].call_state.yield_states, [])
+
+    def test_call_stacks_of_tasks(self):
+        result = monitor_async(AsyncCalls().serve, ['tests.unit.stub_sut.AsyncCalls'])
+
+        serve = 'tests.unit.stub_sut.AsyncCalls.serve'
+        handler = 'tests.unit.stub_sut.AsyncCalls.handler'
+        self.assertEqual(result[serve].calls[0].call_stack[-1], 'serve')
+        # Gathered tasks continue the call stack of the coroutine that created them
+        for call in result[handler].calls:
+            self.assertEqual(call.call_stack[-2:], (serve, 'handler'))
+        for call in result['tests.unit.stub_sut.AsyncCalls.fetch'].calls:
+            self.assertEqual(call.call_stack[-3:], (serve, handler, 'fetch'))
+
+    def test_call_stacks_without_task_factory(self):
+        handler = 'tests.unit.stub_sut.AsyncCalls.handler'
+        result = monitor(lambda: asyncio.run(AsyncCalls().serve()), [handler])
+
+        for call in result[handler].calls:
+            self.assertEqual(call.call_stack[-1], 'handler')
+            self.assertNotIn('tests.unit.stub_sut.AsyncCalls.serve', call.call_stack)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+import sys
+import functools
+import weakref
+import threading
+import unittest
+from spotflow.api import monitor, SpotFlow
+from spotflow.collector import Collector, FrameState
+from tests.unit.stub_test import TestRecursion, TestGenerator, TestExceptions
+from tests.unit.stub_sut import Recursion
+
+
+def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class Resource:
+    pass
+
+
+def call_with_resource(resources):
+    resource = Resource()
+    resources.append(weakref.ref(resource))
+    Recursion().run_basic_recursion()
+
+
+@decorator
+def decorated_func(x):
+    return x + 1
+
+
+def current_frame():
+    return sys._getframe(1)
+
+
+def own_frame():
+    return sys._getframe()
+
+
+def leaf():
+    return 1
+
+
+def leaf_generator():
+    while True:
+        yield leaf()
+
+
+def first_caller(generator):
+    return next(generator)
+
+
+def second_caller(generator):
+    return next(generator)
+
+
+def resume_from_two_callers():
+    generator = leaf_generator()
+    first_caller(generator)
+    second_caller(generator)
+
+
+class StaticAndClassMethods:
+
+    @staticmethod
+    def static_method(x):
+        return x
+
+    @classmethod
+    def class_method(cls, x):
+        return x
+
+
+class TestCollector(unittest.TestCase):
+
+    def test_func_or_method_cached_by_code(self):
+        collector = Collector()
+
+        frame1 = own_frame()
+        frame2 = own_frame()
+        self.assertIsNot(frame1, frame2)
+
+        func = collector.ensure_func_or_method(frame1)
+        self.assertIs(func, own_frame)
+        self.assertIs(collector.ensure_func_or_method(frame2), func)
+        self.assertEqual(list(collector.funcs_cache), [frame1.f_code])
+
+    def test_target_method_cached_by_code(self):
+        collector = Collector()
+        collector.method_names = ['tests.unit.test_collector']
+        collector.init_target()
+
+        frame = current_frame()
+        method_info = collector.target_method_for_frame(frame)
+        self.assertEqual(method_info.full_name,
+                         'tests.unit.test_collector.TestCollector.test_target_method_cached_by_code')
+        self.assertIs(collector.target_codes_cache[frame.f_code], method_info)
+
+    def test_non_target_method_cached_by_code(self):
+        collector = Collector()
+        collector.method_names = ['tests.unit.stub_sut']
+        collector.init_target()
+
+        frame = current_frame()
+        self.assertIsNone(collector.target_method_for_frame(frame))
+        self.assertIn(frame.f_code, collector.target_codes_cache)
+
+    def test_decorated_func(self):
+        method_name = 'tests.unit.test_collector.decorated_func'
+        result = monitor(lambda: decorated_func(1), [method_name])
+
+        self.assertEqual(len(result), 1)
+        calls = result[method_name].calls
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0].call_state.return_state.value, '2')
+
+    def test_static_and_class_methods(self):
+        method_name = 'tests.unit.test_collector.StaticAndClassMethods'
+
+        def func():
+            StaticAndClassMethods.static_method(1)
+            StaticAndClassMethods.class_method(2)
+
+        result = monitor(func, [method_name])
+
+        self.assertIn('tests.unit.test_collector.StaticAndClassMethods.class_method', result)
+        if sys.version_info >= (3, 11):
+            self.assertIn('tests.unit.test_collector.StaticAndClassMethods.static_method', result)
+
+    def test_call_stack_of_recursion(self):
+        method_name = 'tests.unit.stub_sut.Recursion.basic_recursion'
+        result = monitor(TestRecursion().test_basic_recursion, [method_name])
+
+        base = ('tests.unit.stub_test.TestRecursion.test_basic_recursion',
+                'tests.unit.stub_sut.Recursion.run_basic_recursion')
+        call_stacks = [call.call_stack for call in result[method_name].calls]
+        self.assertEqual(call_stacks, [base + ('basic_recursion',),
+                                       base + (method_name, 'basic_recursion'),
+                                       base + (method_name, method_name, 'basic_recursion')])
+
+    def test_call_stack_of_generator_resumed_from_other_caller(self):
+        method_name = 'tests.unit.test_collector.leaf'
+        result = monitor(resume_from_two_callers, [method_name])
+
+        module = 'tests.unit.test_collector.'
+        call_stacks = [call.call_stack[-4:] for call in result[method_name].calls]
+        self.assertEqual(call_stacks, [(module + 'resume_from_two_callers', module + 'first_caller',
+                                        module + 'leaf_generator', 'leaf'),
+                                       (module + 'resume_from_two_callers', module + 'second_caller',
+                                        module + 'leaf_generator', 'leaf')])
+
+    def test_state_of_finished_frame_is_not_reused(self):
+        # Eg, the state of a generator closed while suspended, whose id is reused by a frame of other code
+        frame = own_frame()
+        active_frames = {id(frame): FrameState(leaf.__code__, None)}
+        self.assertIsNone(Collector().frame_state(frame, active_frames))
+        self.assertEqual(active_frames, {})
+
+        frame_state = active_frames[id(frame)] = FrameState(frame.f_code, None)
+        self.assertIs(Collector().frame_state(frame, active_frames), frame_state)
+
+    def test_call_stack_is_cleared_on_stop(self):
+        flow = SpotFlow()
+        flow.target_methods(['tests.unit.stub_sut'])
+        flow.start()
+        TestGenerator().test_call_generator_1()
+        shadow_stack = flow.collector.thread_state().shadow_stack
+        flow.stop()
+
+        self.assertEqual(shadow_stack.ids, [])
+        self.assertEqual(shadow_stack.indexes, {})
+
+    def test_call_stack_does_not_keep_callers_alive(self):
+        method_name = 'tests.unit.stub_sut.Recursion.basic_recursion'
+        resources = []
+        flow = SpotFlow()
+        flow.target_methods([method_name])
+        flow.start()
+        call_with_resource(resources)
+        freed = resources[0]() is None
+        flow.stop()
+
+        self.assertTrue(freed)
+        call_stack = flow.result()[method_name].calls[0].call_stack
+        self.assertEqual(call_stack[-3:], ('tests.unit.test_collector.call_with_resource',
+                                           'tests.unit.stub_sut.Recursion.run_basic_recursion', 'basic_recursion'))
+
+    def test_active_frames_are_dropped_when_finished(self):
+        flow = SpotFlow()
+        flow.target_methods(['tests.unit.stub_sut'])
+        flow.start()
+        TestRecursion().test_basic_recursion()
+        TestExceptions().test_calls_with_exceptions()
+        active_frames = dict(flow.collector.thread_state().active_frames)
+        flow.stop()
+
+        self.assertEqual(active_frames, {})
+
+    def test_last_line_per_frame(self):
+        method_name = 'tests.unit.stub_sut.Recursion.basic_recursion'
+        result = monitor(TestRecursion().test_basic_recursion, [method_name])
+
+        for call in result[method_name].calls:
+            first_state = call.call_state.var_states['n'].states[0]
+            self.assertEqual(first_state.inline, -1)
+
+    def test_threads(self):
+        method_name = 'tests.unit.stub_sut.Recursion.basic_recursion'
+        expected = monitor(TestRecursion().test_basic_recursion, [method_name])
+
+        flow = SpotFlow()
+        flow.target_methods([method_name])
+        flow.start()
+        threads = [threading.Thread(target=TestRecursion().test_basic_recursion) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        TestRecursion().test_basic_recursion()
+        for thread in threads:
+            thread.join()
+        flow.stop()
+
+        calls = flow.result()[method_name].calls
+        expected_calls = expected[method_name].calls
+        self.assertEqual(len(calls), 5 * len(expected_calls))
+        # The calls of the thread that started monitoring come first
+        self.assertEqual([call.call_stack for call in calls[:3]], [call.call_stack for call in expected_calls])
+        for call in calls:
+            self.assertIs(call.monitored_method, flow.result()[method_name])
+            self.assertEqual(call.call_stack[-1], 'basic_recursion')
+        self.assertEqual(flow.result()[method_name].run_lines,
+                         {line: freq * 5 for line, freq in expected[method_name].run_lines.items()})
+        self.assertEqual(flow.collector.thread_states, {})
+
+    @unittest.skipUnless(sys.version_info >= (3, 12), 'requires threading.settrace_all_threads')
+    def test_running_threads(self):
+        method_name = 'tests.unit.stub_sut.Recursion.basic_recursion'
+        started = threading.Event()
+        monitoring = threading.Event()
+
+        def run():
+            started.set()
+            monitoring.wait()
+            TestRecursion().test_basic_recursion()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        started.wait()
+
+        flow = SpotFlow()
+        flow.target_methods([method_name])
+        flow.start()
+        monitoring.set()
+        thread.join()
+        flow.stop()
+
+        self.assertEqual(len(flow.result()[method_name].calls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from tests.unit.stub_test import TestSimpleCall, TestChangeState, TestExceptions, TestGenerator, \
+    TestGeneratorExpression, TestRecursion
+from spotflow.api import SpotFlow
+from spotflow.eventlog import read_records, read_event_log, STRING, METHOD, CALL, LINE
+
+
+def summary(monitored_program):
+    methods = []
+    for method in monitored_program:
+        calls = []
+        for call in method.calls:
+            state = call.call_state
+            var_states = [(each.name, each.value, each.lineno, each.inline, each.value_has_changed)
+                          for var in state.var_states.values() for each in var.states]
+            calls.append((call.call_stack, call.run_lines,
+                          [str(arg) for arg in state.arg_states],
+                          str(state.return_state),
+                          [str(each) for each in state.yield_states],
+                          str(state.exception_state),
+                          var_states))
+        methods.append((method.full_name, calls, dict(method.run_lines), len(method.flows)))
+    return methods
+
+
+class TestEventLog(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def monitor(self, func, record=False, var_states=True):
+        flow = SpotFlow()
+        flow.target_methods(['tests.unit.stub_sut'])
+        flow.collect_states(var_states=var_states)
+        if record:
+            flow.record(self.path)
+
+        flow.start()
+        func()
+        flow.stop()
+
+        if record:
+            flow.rebuild(self.path)
+        return flow.result()
+
+    def test_rebuild(self):
+        test_classes = [TestSimpleCall, TestChangeState, TestExceptions, TestGenerator, TestGeneratorExpression,
+                        TestRecursion]
+
+        for test_class in test_classes:
+            for name in dir(test_class):
+                if name.startswith('test_'):
+                    for var_states in (True, 'changes'):
+                        func = getattr(test_class(), name)
+                        with self.subTest(test=f'{test_class.__name__}.{name}', var_states=var_states):
+                            expected = self.monitor(func, var_states=var_states)
+                            actual = self.monitor(func, record=True, var_states=var_states)
+                            self.assertEqual(summary(actual), summary(expected))
+
+    def test_records(self):
+        self.monitor(TestRecursion().test_basic_recursion, record=True)
+
+        kinds = [record[0] for record, data in read_records(self.path)]
+        self.assertEqual(kinds.count(CALL), 4)
+        self.assertEqual(kinds.count(LINE), 7)
+
+        # Strings are written once
+        strings = [data for record, data in read_records(self.path) if record[0] == STRING]
+        self.assertEqual(len(strings), len(set(strings)))
+
+        monitored_program = read_event_log(self.path)
+        self.assertEqual(len(monitored_program['tests.unit.stub_sut.Recursion.basic_recursion'].calls), 3)
+
+        # Method infos are plain data
+        expected = self.monitor(TestRecursion().test_basic_recursion)
+        methods = [json.loads(data) for record, data in read_records(self.path) if record[0] == METHOD]
+        self.assertEqual(methods[-1], expected[methods[-1]['full_name']].info.to_data())
+        for method in monitored_program:
+            self.assertEqual(method.info.to_data(), expected[method.full_name].info.to_data())
+
+    def test_interned_strings_are_bounded(self):
+        with mock.patch('spotflow.eventlog.MAX_INTERNED_STRINGS', 2):
+            self.monitor(TestRecursion().test_basic_recursion, record=True)
+
+        strings = [data for record, data in read_records(self.path) if record[0] == STRING]
+        self.assertGreater(len(strings), len(set(strings)))
+        flow = SpotFlow()
+        flow.rebuild(self.path)
+        self.assertEqual(summary(flow.result()), summary(self.monitor(TestRecursion().test_basic_recursion)))
+
+    def test_threads(self):
+        funcs = [getattr(test_class(), name) for test_class in (TestSimpleCall, TestChangeState, TestRecursion)
+                 for name in dir(test_class) if name.startswith('test_')]
+
+        def run():
+            for func in funcs:
+                func()
+
+        expected = self.monitor(run)
+
+        flow = SpotFlow()
+        flow.target_methods(['tests.unit.stub_sut'])
+        flow.record(self.path)
+        flow.start()
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        flow.stop()
+
+        # Every record refers to strings and methods written before it
+        monitored_program = read_event_log(self.path)
+        for method in expected:
+            self.assertEqual(len(monitored_program[method.full_name].calls), 8 * len(method.calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
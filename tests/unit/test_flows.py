@@ -0,0 +1,108 @@
+import unittest
+from spotflow.api import SpotFlow
+from spotflow.info import MethodInfo, Analysis, CallStats
+
+
+def branches(n):
+    total = 0
+    if n & 1:
+        total += 1
+    if n & 2:
+        total += 2
+    if n & 4:
+        total += 4
+    if n & 8:
+        total += 8
+    return total
+
+
+def documented(x):
+    """Returns x,
+    or 0 if x is negative"""
+    if x < 0:
+        return 0
+    return x
+
+
+def call_branches():
+    # Each n takes its own path, n = 0 the most often
+    for n in range(16):
+        for _ in range(16 - n):
+            branches(n)
+
+
+class TestFlows(unittest.TestCase):
+
+    def monitor(self, max_flows):
+        flow = SpotFlow()
+        flow.target_methods(['tests.unit.test_flows.branches'])
+        flow.max_flows(max_flows)
+
+        flow.start()
+        call_branches()
+        flow.stop()
+
+        return flow.result()['tests.unit.test_flows.branches']
+
+    def test_flows_by_number_of_calls(self):
+        monitored_method = self.monitor(None)
+
+        self.assertEqual(len(monitored_method.flows), 16)
+        self.assertEqual([len(flow.calls) for flow in monitored_method.flows], list(range(16, 0, -1)))
+        self.assertEqual([flow.pos for flow in monitored_method.flows], list(range(1, 17)))
+        self.assertEqual(monitored_method.other_calls, [])
+
+        first_line = branches.__code__.co_firstlineno
+        top_flow = monitored_method.flows[0]
+        self.assertEqual(top_flow.distinct_run_lines, tuple(first_line + offset for offset in (1, 2, 4, 6, 8, 10)))
+        for call in top_flow.calls:
+            self.assertEqual(tuple(call.distinct_run_lines()), top_flow.distinct_run_lines)
+
+    def test_max_flows(self):
+        monitored_method = self.monitor(10)
+
+        self.assertEqual(len(monitored_method.flows), 10)
+        self.assertEqual([len(flow.calls) for flow in monitored_method.flows], list(range(16, 6, -1)))
+        # The calls of the other flows are not lost
+        self.assertEqual(len(monitored_method.other_calls), 6 + 5 + 4 + 3 + 2 + 1)
+        self.assertEqual(monitored_method.info.total_flows, 10)
+
+    def test_max_flows_zero_keeps_all_flows(self):
+        monitored_method = self.monitor(0)
+
+        self.assertEqual(len(monitored_method.flows), 16)
+        self.assertEqual(monitored_method.other_calls, [])
+        self.assertEqual(monitored_method.info.total_flows, 16)
+
+    def test_call_stats(self):
+        monitored_method = self.monitor(10)
+
+        for flow in monitored_method.flows:
+            analysis = Analysis(flow)
+            self.assertEqual(flow.info.call_stats.most_common_arg_values(), analysis.most_common_arg_values())
+            self.assertEqual(flow.info.call_stats.return_values.most_common(10), analysis.most_common_return_values())
+
+        call_stats = CallStats(monitored_method.calls)
+        self.assertEqual(call_stats.tests, set(monitored_method.tests()))
+        self.assertEqual(call_stats.exception_count(), len(monitored_method.exception_states()))
+        self.assertEqual(monitored_method.info.total_tests, len(monitored_method.tests()))
+
+    def test_line_statuses(self):
+        method_info = MethodInfo.build(documented)
+        first_line = documented.__code__.co_firstlineno
+
+        offsets = [line - first_line for line in method_info.executable_lines()]
+        self.assertEqual(offsets, [0, 3, 4, 5])
+        self.assertTrue(method_info._line_is_executable(first_line + 4))
+        self.assertFalse(method_info._line_is_executable(first_line + 1))
+        self.assertFalse(method_info._line_is_executable(first_line + 100))
+        # The def line is executable for trace, but it is not in the body
+        self.assertFalse(method_info._line_is_body(first_line))
+        self.assertFalse(method_info._line_is_body(first_line + 2))
+        self.assertTrue(method_info._line_is_body(first_line + 3))
+        self.assertEqual(method_info._next_executable_line(first_line), first_line + 3)
+        self.assertIsNone(method_info._next_executable_line(first_line + 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
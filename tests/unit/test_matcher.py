@@ -0,0 +1,66 @@
+import unittest
+from spotflow.matcher import TargetMatcher
+from tests.unit.stub_sut import Calculator
+
+
+class TestMatcher(unittest.TestCase):
+
+    def test_match_all_methods(self):
+        matcher = TargetMatcher()
+        self.assertTrue(matcher.is_target_method('any.method'))
+
+    def test_match_no_methods(self):
+        matcher = TargetMatcher(method_names=[])
+        self.assertFalse(matcher.is_target_method('any.method'))
+
+    def test_match_prefix_and_suffix(self):
+        matcher = TargetMatcher(method_names=['parser.StringParser', 'count'])
+        self.assertTrue(matcher.is_target_method('parser.StringParser.parse'))
+        self.assertTrue(matcher.is_target_method('other.Parser.count'))
+        self.assertFalse(matcher.is_target_method('other.Parser.parse'))
+
+    def test_match_many_prefixes(self):
+        method_names = [f'module{i}.func' for i in range(100)]
+        matcher = TargetMatcher(method_names=method_names)
+        self.assertTrue(matcher.is_target_method('module99.func'))
+        self.assertFalse(matcher.is_target_method('module100.foo'))
+
+    def test_match_regex(self):
+        matcher = TargetMatcher(method_names=[r're:^parser\.\w+\.count$'])
+        self.assertTrue(matcher.is_target_method('parser.StringParser.count'))
+        self.assertFalse(matcher.is_target_method('parser.StringParser.count_all'))
+
+    def test_match_glob(self):
+        matcher = TargetMatcher(method_names=['glob:parser.*.count'])
+        self.assertTrue(matcher.is_target_method('parser.StringParser.count'))
+        self.assertFalse(matcher.is_target_method('other.parser.StringParser.count'))
+
+    def test_match_func(self):
+        matcher = TargetMatcher(method_names=[Calculator.add])
+        self.assertTrue(matcher.is_target_method('tests.unit.stub_sut.Calculator.add'))
+        self.assertFalse(matcher.is_target_method('tests.unit.stub_sut.Calculator'))
+        self.assertEqual(matcher.target_func('tests.unit.stub_sut.Calculator.add'), Calculator.add)
+
+    def test_file_verdict(self):
+        matcher = TargetMatcher(file_names=['stub_sut', 'glob:*/lib/*.py'], ignore_files=['re:ignored_\\d'])
+        self.assertTrue(matcher.file_verdict('/tests/unit/stub_sut.py'))
+        self.assertTrue(matcher.file_verdict('/usr/lib/os.py'))
+        self.assertIsNone(matcher.file_verdict('/tests/unit/other.py'))
+        self.assertFalse(matcher.file_verdict('/tests/unit/stub_sut_ignored_1.py'))
+        self.assertFalse(matcher.file_verdict('<string>'))
+
+    def test_file_verdict_without_target_files(self):
+        matcher = TargetMatcher(ignore_files=['genericpath.py'])
+        self.assertTrue(matcher.file_verdict('/lib/posixpath.py'))
+        self.assertFalse(matcher.file_verdict('/lib/genericpath.py'))
+
+    def test_memoized(self):
+        matcher = TargetMatcher(method_names=['parser'], file_names=['parser'])
+        matcher.is_target_method('parser.parse')
+        matcher.file_verdict('parser.py')
+        self.assertEqual(matcher.methods_cache, {'parser.parse': True})
+        self.assertEqual(matcher.files_cache, {'parser.py': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import tempfile
+import subprocess
+import unittest
+import multiprocessing
+from spotflow.api import SpotFlow, monitor
+from spotflow.multiproc import BOOTSTRAP_DIR, PATCHED_MARKER, save_shard, load_shards
+from tests.unit.stub_test import TestRecursion, TestChangeState, TestGenerator, TestExceptions
+from tests.unit.test_eventlog import summary
+
+method_name = 'tests.unit.stub_sut.Recursion.basic_recursion'
+
+
+def run_recursion():
+    TestRecursion().test_basic_recursion()
+
+
+def long_loop(n):
+    total = 0
+    for i in range(n):
+        total += i % 3
+    return total
+
+
+class TestMultiproc(unittest.TestCase):
+
+    def setUp(self):
+        self.shards_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.shards_dir)
+
+    def monitor_parallel(self, func):
+        flow = SpotFlow()
+        flow.target_methods([method_name])
+        flow.parallel(self.shards_dir)
+
+        flow.start()
+        run_recursion()
+        func()
+        flow.stop()
+
+        return flow.result()
+
+    def assert_calls_of_two_processes(self, monitored_program):
+        expected = monitor(run_recursion, [method_name])[method_name]
+        monitored_method = monitored_program[method_name]
+
+        self.assertEqual([call.call_stack for call in monitored_method.calls],
+                         [call.call_stack for call in expected.calls] * 2)
+        self.assertEqual([call.run_lines for call in monitored_method.calls],
+                         [call.run_lines for call in expected.calls] * 2)
+        self.assertEqual(len(monitored_method.flows), len(expected.flows))
+        self.assertEqual(monitored_method.info.total_calls, 6)
+        self.assertEqual(os.listdir(self.shards_dir), [])
+
+    def test_shards(self):
+        save_shard(monitor(run_recursion, [method_name]), self.shards_dir)
+        save_shard(monitor(run_recursion, [method_name]), self.shards_dir)
+
+        flow = SpotFlow()
+        flow.combine(self.shards_dir)
+        self.assertEqual(len(flow.result()[method_name].calls), 6)
+        self.assertEqual(load_shards(self.shards_dir), [])
+
+    def test_shards_are_plain_data(self):
+        for func in (TestChangeState().test_change_var_state_with_loop, TestGenerator().test_call_generator_3,
+                     TestExceptions().test_zero_division, lambda: long_loop(100)):
+            with self.subTest(func=func.__name__):
+                flow = SpotFlow()
+                flow.target_methods(['tests.unit.stub_sut', 'tests.unit.test_multiproc.long_loop'])
+                flow.collect_states(var_states='changes')
+                flow.start()
+                func()
+                flow.stop()
+
+                path = save_shard(flow.result(), self.shards_dir)
+                with open(path) as f:
+                    json.load(f)
+                combined = SpotFlow()
+                combined.combine(self.shards_dir)
+                self.assertEqual(summary(combined.result()), summary(flow.result()))
+
+    def test_pickled_shards_are_not_loaded(self):
+        path = os.path.join(self.shards_dir, 'spotflow.host.1.000001.shard')
+        with open(path, 'wb') as f:
+            pickle.dump(monitor(run_recursion, [method_name]), f)
+        self.assertEqual(load_shards(self.shards_dir), [])
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), 'requires fork')
+    def test_fork(self):
+        def run_process():
+            process = multiprocessing.get_context('fork').Process(target=run_recursion)
+            process.start()
+            process.join()
+
+        self.assert_calls_of_two_processes(self.monitor_parallel(run_process))
+
+    def test_spawn(self):
+        def run_process():
+            process = multiprocessing.get_context('spawn').Process(target=run_recursion)
+            process.start()
+            process.join()
+
+        self.assert_calls_of_two_processes(self.monitor_parallel(run_process))
+
+    def test_subprocess(self):
+        def run_process():
+            code = 'from tests.unit.test_multiproc import run_recursion; run_recursion()'
+            subprocess.run([sys.executable, '-c', code], check=True)
+
+        self.assert_calls_of_two_processes(self.monitor_parallel(run_process))
+
+    def test_children_are_not_monitored_after_stop(self):
+        self.monitor_parallel(lambda: None)
+        code = 'from tests.unit.test_multiproc import run_recursion; run_recursion()'
+        subprocess.run([sys.executable, '-c', code], check=True)
+        self.assertEqual(os.listdir(self.shards_dir), [])
+
+    def test_stop_restores_environment(self):
+        python_path = os.environ.get('PYTHONPATH')
+        bootstrap = multiprocessing.process.BaseProcess._bootstrap
+
+        def check_environment():
+            self.assertEqual(os.environ['PYTHONPATH'].split(os.pathsep)[0], BOOTSTRAP_DIR)
+            self.assertNotIn(os.path.dirname(os.path.dirname(BOOTSTRAP_DIR)),
+                             os.environ['PYTHONPATH'].split(os.pathsep))
+            self.assertTrue(hasattr(multiprocessing, PATCHED_MARKER))
+
+        self.monitor_parallel(check_environment)
+        self.assertEqual(os.environ.get('PYTHONPATH'), python_path)
+        self.assertIs(multiprocessing.process.BaseProcess._bootstrap, bootstrap)
+        self.assertFalse(hasattr(multiprocessing, PATCHED_MARKER))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import ctypes
+import unittest
+import zlib
+from spotflow.api import SpotFlow
+from spotflow.render import ValueRenderer, checksum
+from spotflow.utils import obj_value
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Point:
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class ItemsRenderer(ValueRenderer):
+
+    def render_scalars(self, *args):
+        return None
+
+
+class UncastableView:
+
+    c_contiguous = True
+    ndim = 1
+    format = '>i'
+
+    def cast(self, format):
+        raise ValueError('memoryview: cannot cast')
+
+
+def make_point():
+    point = Point(1, 2)
+    return point
+
+
+class TestRender(unittest.TestCase):
+
+    def test_same_as_repr(self):
+        renderer = ValueRenderer()
+        values = [1, 'foo', None, True, 1.5, (1,), (1, 2), [1, [2, 3]], {1: 'a'}, {'a'}, frozenset({1}),
+                  set(), frozenset(), [], {}, ()]
+        for value in values:
+            self.assertEqual(renderer.render(value), repr(value))
+
+    def test_max_items(self):
+        renderer = ValueRenderer(max_items=3)
+        self.assertEqual(renderer.render(list(range(1000000))), '[0, 1, 2, ...]')
+        self.assertEqual(renderer.render(tuple(range(4))), '(0, 1, 2, ...)')
+        self.assertEqual(renderer.render(dict.fromkeys(range(4), 0)), '{0: 0, 1: 0, 2: 0, ...}')
+
+    def test_max_depth(self):
+        renderer = ValueRenderer(max_depth=2)
+        self.assertEqual(renderer.render([1, [2, [3, [4]]]]), '[1, [2, [...]]]')
+
+    def test_max_string(self):
+        renderer = ValueRenderer(max_string=3)
+        self.assertEqual(renderer.render('abcdef'), "'abc'...")
+        self.assertEqual(renderer.render(10 ** 10), '<int of 34 bits>')
+
+    def test_max_length(self):
+        renderer = ValueRenderer(max_length=10)
+        self.assertEqual(renderer.render(list(range(100))), '[0, 1, 2, 3, ...]')
+
+    def test_scalars_rendered_like_items(self):
+        values = [list(range(300)), tuple(range(3)), (True, None, 1.5), {'a', 'b'}, frozenset({1}), ['abcdef', 'ab'],
+                  [10 ** 10, 1], [1.5, 2], {'a': 1, 'b': 2.5}, dict.fromkeys('abcde', None), [[1, 2], (3,)]]
+        for limits in ({}, {'max_items': 3}, {'max_string': 3}, {'max_length': 10}, {'max_depth': 1}):
+            renderer = ValueRenderer(**limits)
+            walker = ItemsRenderer(**limits)
+            for value in values:
+                self.assertEqual(renderer.render(value), walker.render(value), (limits, value))
+
+    def test_recursive_container(self):
+        value = [1]
+        value.append(value)
+        self.assertEqual(ValueRenderer().render(value), repr(value))
+
+    def test_time_budget(self):
+        renderer = ValueRenderer(time_budget=0)
+        self.assertEqual(renderer.render([1, 2, 3]), '...')
+
+    def test_obj_value_with_renderer(self):
+        self.assertEqual(obj_value(list(range(10)), ValueRenderer(max_items=2)), '[0, 1, ...]')
+
+    def test_collect_states(self):
+        flow = SpotFlow()
+        flow.collect_states(max_items=5, max_string=10)
+        self.assertEqual(flow.collector.value_renderer.max_items, 5)
+        self.assertEqual(flow.collector.value_renderer.max_string, 10)
+
+    def test_formatters_cached_by_type(self):
+        renderer = ValueRenderer()
+        self.assertEqual(renderer.value([1, 2]), '[1, 2]')
+        self.assertEqual(renderer.value([Point(1, 2)]), 'list')
+        self.assertEqual(renderer.value(Point(1, 2)), 'Point')
+        self.assertEqual(renderer.value(Point), 'Point def')
+        self.assertEqual(set(renderer.formatters), {list, Point, type})
+
+    def test_register_formatter(self):
+        renderer = ValueRenderer()
+        renderer.register_formatter(Point, lambda point: f'Point({point.x}, {point.y})')
+        self.assertEqual(renderer.value(Point(1, 2)), 'Point(1, 2)')
+        self.assertEqual(renderer.value([1, Point(3, 4)]), '[1, Point(3, 4)]')
+
+    def test_register_formatter_in_flow(self):
+        flow = SpotFlow()
+        flow.target_methods(['tests.unit.test_render.make_point'])
+        flow.register_formatter(Point, lambda point: f'Point({point.x}, {point.y})')
+        flow.start()
+        make_point()
+        flow.stop()
+
+        call_state = flow.result()['tests.unit.test_render.make_point'].calls[0].call_state
+        self.assertEqual(call_state.return_state.value, 'Point(1, 2)')
+        self.assertEqual(str(call_state.var_states['point']), 'point: Point(1, 2)')
+
+    def test_failing_formatter(self):
+        renderer = ValueRenderer()
+        renderer.register_formatter(Point, lambda point: point.z)
+        self.assertEqual(renderer.value(Point(1, 2)), 'Point')
+
+    def test_summarize_buffers(self):
+        renderer = ValueRenderer()
+        data = b'spotflow'
+        crc = f'{zlib.crc32(data):#010x}'
+        self.assertEqual(renderer.value(data), f'bytes(len=8, crc32={crc})')
+        self.assertEqual(renderer.value(bytearray(data)), f'bytearray(len=8, crc32={crc})')
+        self.assertEqual(renderer.value(memoryview(data)), f'memoryview(len=8, crc32={crc})')
+        self.assertEqual(renderer.value(memoryview(data)[::2]), 'memoryview(len=4)')
+        self.assertTrue(renderer.value(bytes(2 ** 21)).startswith('bytes(len=2097152, prefix_crc32='))
+
+    def test_summarize_non_native_buffers(self):
+        renderer = ValueRenderer()
+        big_endian = (ctypes.c_int32.__ctype_be__ * 2)(1, 2)
+        crc = f'{zlib.crc32(bytes(big_endian)):#010x}'
+        self.assertEqual(memoryview(big_endian).format, '>i')
+        self.assertEqual(renderer.value(memoryview(big_endian)), f'memoryview(len=8, crc32={crc})')
+        self.assertEqual(checksum(UncastableView()), '')
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_summarize_arrays(self):
+        renderer = ValueRenderer()
+        array = numpy.zeros((2, 3))
+        crc = f'{zlib.crc32(array.tobytes()):#010x}'
+        self.assertEqual(renderer.value(array), f'ndarray(shape=(2, 3), dtype=float64, nbytes=48, crc32={crc})')
+        self.assertEqual(renderer.value(numpy.array([None, 1])), 'ndarray(shape=(2,), dtype=object, nbytes=16)')
+
+
+if __name__ == '__main__':
+    unittest.main()
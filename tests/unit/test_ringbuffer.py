@@ -0,0 +1,120 @@
+import sys
+import unittest
+from tests.unit.stub_test import TestSimpleCall, TestChangeState, TestExceptions, TestRecursion, TestGenerator, \
+    TestGeneratorExpression
+from tests.unit.test_eventlog import summary
+from spotflow.api import SpotFlow
+from spotflow.ringbuffer import RingBuffer, DROP, SPILL
+
+
+def render_int(value):
+    return str(value)
+
+
+def add(a, b):
+    return a + b
+
+
+def fill(n):
+    items = []
+    counts = {}
+    for i in range(n):
+        items.append(i)
+        counts[i % 3] = counts.get(i % 3, 0) + 1
+    return items, counts
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def monitor(self, func, var_states=True, capacity=None, overflow='block', target='tests.unit.stub_sut'):
+        flow = SpotFlow()
+        flow.target_methods([target])
+        flow.collect_states(var_states=var_states)
+        if capacity:
+            flow.buffered(capacity, overflow)
+
+        flow.start()
+        func()
+        flow.stop()
+        return flow.result()
+
+    def test_buffered(self):
+        test_classes = [TestSimpleCall, TestChangeState, TestExceptions, TestRecursion, TestGenerator,
+                        TestGeneratorExpression]
+
+        for test_class in test_classes:
+            for name in dir(test_class):
+                if name.startswith('test_'):
+                    for var_states in (True, 'changes'):
+                        for capacity, overflow in ((2, 'block'), (2, 'spill'), (1000, 'block')):
+                            func = getattr(test_class(), name)
+                            with self.subTest(test=f'{test_class.__name__}.{name}', var_states=var_states,
+                                              capacity=capacity, overflow=overflow):
+                                expected = self.monitor(func, var_states=var_states)
+                                actual = self.monitor(func, var_states, capacity, overflow)
+                                self.assertEqual(summary(actual), summary(expected))
+
+    def test_values_changed_in_place(self):
+        # Lists and dicts are copied when pushed, so they are saved as they were
+        func = lambda: fill(20)
+        for var_states in (True, 'changes'):
+            with self.subTest(var_states=var_states):
+                expected = self.monitor(func, var_states, target='tests.unit.test_ringbuffer.fill')
+                actual = self.monitor(func, var_states, 1000, target='tests.unit.test_ringbuffer.fill')
+                self.assertEqual(summary(actual), summary(expected))
+
+    def test_consumer_is_not_monitored(self):
+        # The consumer renders the ints, calling a target function
+        tracers = ['settrace', 'setprofile'] + (['monitoring'] if sys.version_info >= (3, 12) else [])
+        for tracer in tracers:
+            with self.subTest(tracer=tracer):
+                flow = SpotFlow()
+                flow.target_methods(['tests.unit.test_ringbuffer.add', 'tests.unit.test_ringbuffer.render_int'])
+                flow.tracer(tracer)
+                flow.buffered(2)
+                flow.register_formatter(int, render_int)
+
+                flow.start()
+                for i in range(10):
+                    add(i, 1)
+                flow.stop()
+
+                self.assertEqual(len(flow.result()['tests.unit.test_ringbuffer.add'].calls), 10)
+                self.assertNotIn('tests.unit.test_ringbuffer.render_int', flow.result())
+
+    def test_drop(self):
+        consumed = []
+        buffer = RingBuffer(consumed.append, capacity=2, overflow=DROP)
+        for i in range(5):
+            buffer.push(('event', {'i': i}))
+
+        self.assertEqual(buffer.dropped, 3)
+        self.assertEqual(buffer.drain(), 2)
+        self.assertEqual(consumed, [('event', {'i': 0}), ('event', {'i': 1})])
+
+        # Freed slots are reused
+        buffer.push(('event', {'i': 5}))
+        self.assertEqual(buffer.drain(), 1)
+        self.assertEqual(consumed[-1], ('event', {'i': 5}))
+
+    def test_spill(self):
+        consumed = []
+        spill_values = lambda values: {name: str(value) for name, value in values.items()}
+        buffer = RingBuffer(consumed.append, capacity=2, overflow=SPILL, spill_values=spill_values)
+        for i in range(5):
+            buffer.push(('event', {'i': i}))
+
+        self.assertEqual(buffer.spilled, 3)
+        self.assertEqual(buffer.drain(), 5)
+        # Spilled events keep their order, with their values rendered
+        self.assertEqual(consumed, [('event', {'i': 0}), ('event', {'i': 1}), ('event', {'i': '2'}),
+                                    ('event', {'i': '3'}), ('event', {'i': '4'})])
+        buffer.close()
+
+    def test_unknown_overflow(self):
+        with self.assertRaises(ValueError):
+            RingBuffer(print, overflow='wait')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from tests.unit.stub_test import TestSimpleCall
+from spotflow.api import monitor
+from spotflow.model import RunLines
+
+
+class TestRunLines(unittest.TestCase):
+
+    def test_same_as_list(self):
+        lines = [2, 3, 4, 3, 4, 3, 5, 6, 5, 7, 5, 6, 5, 6, 5, 6, 5, 7, 8]
+        run_lines = RunLines(lines)
+
+        self.assertEqual(run_lines, lines)
+        self.assertEqual(list(run_lines), lines)
+        self.assertEqual(len(run_lines), len(lines))
+        self.assertEqual([run_lines[i] for i in range(len(lines))], lines)
+        self.assertEqual(run_lines[-1], 8)
+        self.assertEqual(str(run_lines), str(lines))
+        self.assertEqual(run_lines.distinct(), [2, 3, 4, 5, 6, 7, 8])
+        self.assertIn(7, run_lines)
+        self.assertNotEqual(run_lines, lines[:-1])
+
+    def test_loops_are_stored_once(self):
+        lines = [2] + [3, 4, 5] * 1000 + [3, 4, 6] + [3, 4] * 1000 + [7]
+        run_lines = RunLines(lines)
+
+        self.assertEqual(run_lines, lines)
+        self.assertEqual([(list(block), repeats) for block, repeats in run_lines.segments],
+                         [([2], 1), ([3, 4, 5], 1000), ([3, 4, 6], 1), ([3, 4], 1000)])
+        self.assertEqual(list(run_lines.literal), [7])
+
+    def test_loops_with_alternating_paths(self):
+        lines = [2] + [3, 4, 3, 5, 6] * 1000 + [7]
+        run_lines = RunLines(lines)
+
+        self.assertEqual(run_lines, lines)
+        self.assertEqual([(list(block), repeats) for block, repeats in run_lines.segments],
+                         [([2], 1), ([3, 4, 3, 5, 6], 1000)])
+
+    def test_short_repetitions_are_not_blocks(self):
+        lines = [2, 3, 4, 3, 4, 3, 4, 5]
+        run_lines = RunLines(lines)
+
+        self.assertEqual(run_lines, lines)
+        self.assertEqual(run_lines.segments, [])
+
+    def test_calls(self):
+        method_name = 'tests.unit.stub_sut.SimpleCall.loop'
+        result = monitor(TestSimpleCall().test_loop, [method_name])
+
+        call = result[method_name].calls[0]
+        self.assertIsInstance(call.run_lines, RunLines)
+        self.assertEqual(call.run_lines, list(call.run_lines))
+        self.assertEqual(call.distinct_run_lines(), sorted(set(call.run_lines)))
+
+
+if __name__ == '__main__':
+    unittest.main()
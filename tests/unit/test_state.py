@@ -1,6 +1,21 @@
 import unittest
 from tests.unit.stub_test import TestChangeState
-from spotflow.api import monitor
+from spotflow.api import SpotFlow, monitor
+from spotflow.model import VarStateHistory
+
+
+class Box:
+
+    def __init__(self):
+        self.value = 0
+
+
+def change_in_place(box):
+    pair = (0, [])
+    box.value = 1
+    pair[1].append(1)
+    box.value = 2
+    return pair
 
 
 class TestState(unittest.TestCase):
@@ -201,6 +216,101 @@ class TestState(unittest.TestCase):
         self.assertFalse(a[1].value_has_changed)
         self.assertFalse(a[2].value_has_changed)
 
+    def test_equal_values_are_shared(self):
+        method_name = 'tests.unit.stub_sut.ChangeState.keep_var_state'
+        func = TestChangeState().test_keep_var_state
+
+        result = monitor(func, [method_name])
+
+        a = result[method_name].calls[0].call_state.var_states['a'].states
+        self.assertIs(a[0].value, a[1].value)
+        self.assertIs(a[1].value, a[2].value)
+        self.assertIn('1', result.value_pool.values)
+
+    def test_only_changed_var_states(self):
+        method_name = 'tests.unit.stub_sut.ChangeState.keep_var_state'
+        func = TestChangeState().test_keep_var_state
+
+        result = monitor(func, [method_name], var_states='changes')
+
+        call_state = result[method_name].calls[0].call_state
+        a = call_state.var_states['a'].states
+        self.assertEqual(len(a), 1)
+        self.assertEqual(a[0].value, '1')
+        self.assertTrue(a[0].value_has_changed)
+
+    def test_only_changed_list_states(self):
+        method_name = 'tests.unit.stub_sut.ChangeState.change_list_state'
+        func = TestChangeState().test_change_list_state
+
+        result = monitor(func, [method_name], var_states='changes')
+
+        call_state = result[method_name].calls[0].call_state
+        values = [state.value for state in call_state.var_states['a'].states]
+        self.assertEqual(values, ['[]', '[1]', '[1, 2]', '[1, 2, 3]', '[1, 2]', '[1]', '[]'])
+
+    def test_only_changed_states_in_place(self):
+        # Objects (here, with a formatter) and tuples of mutable items may change without being rebound
+        method_name = 'tests.unit.test_state.change_in_place'
+        flow = SpotFlow()
+        flow.target_methods([method_name])
+        flow.collect_states(var_states='changes')
+        flow.register_formatter(Box, lambda box: f'Box({box.value})')
+
+        flow.start()
+        change_in_place(Box())
+        flow.stop()
+
+        var_states = flow.result()[method_name].calls[0].call_state.var_states
+        self.assertEqual([state.value for state in var_states['box'].states], ['Box(0)', 'Box(1)', 'Box(2)'])
+        self.assertEqual([state.value for state in var_states['pair'].states], ['(0, [])', '(0, [1])'])
+
+    def test_only_changed_var_states_with_loop(self):
+        method_name = 'tests.unit.stub_sut.ChangeState.change_var_state_with_loop'
+        func = TestChangeState().test_change_var_state_with_loop
+
+        expected = monitor(func, [method_name])
+        result = monitor(func, [method_name], var_states='changes')
+
+        expected_states = expected[method_name].calls[0].call_state.var_states
+        call_state = result[method_name].calls[0].call_state
+        self.assertEqual(list(call_state.var_states), list(expected_states))
+        for name in expected_states:
+            self.assertEqual(str(call_state.var_states[name]), str(expected_states[name]))
+
+    def test_states_for_line(self):
+        method_name = 'tests.unit.stub_sut.ChangeState.change_var_state_with_loop'
+        func = TestChangeState().test_change_var_state_with_loop
+
+        result = monitor(func, [method_name])
+
+        call_state = result[method_name].calls[0].call_state
+        self.assertEqual(call_state._states_for_line(92), ['a: 0'])
+        self.assertEqual(call_state._states_for_line(93), ['i: 1 i: 2 i: 3 i: 4'])
+        self.assertEqual(call_state._states_for_line(94), ['a: 1 a: 2 a: 3 a: 4'])
+        self.assertEqual(call_state._states_for_line(95), [])
+
+        # The index is built again when states are saved
+        call_state._save_var_state('a', '5', 'int', 94, 94)
+        call_state._save_var_state('a', '1', 'int', 94, 94)
+        self.assertEqual(call_state._states_for_line(94), ['a: 1 a: 2 a: 3 a: 4 a: 5'])
+
+    def test_var_states_by_column(self):
+        history = VarStateHistory('a')
+        for value, lineno in (('1', 10), ('1', 11), ('2', 12)):
+            history._add_var_state('a', value, 'int', lineno, lineno - 1)
+
+        self.assertEqual(len(history.states), 3)
+        self.assertEqual([state.value for state in history.states], ['1', '1', '2'])
+        self.assertEqual([state.value_has_changed for state in history.states], [True, False, True])
+        self.assertEqual([(state.lineno, state.inline) for state in history.states[1:]], [(11, 10), (12, 11)])
+        self.assertEqual(str(history.get_last_state()), 'a: 2')
+        self.assertEqual(list(history.distinct_values()), ['1', '2'])
+        self.assertEqual(history.distinct_sequential_values(), ['1', '2'])
+
+        copy = VarStateHistory('a', history.states)
+        self.assertEqual([str(state) for state in copy.states], [str(state) for state in history.states])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+import tests.unit.stub_sut
+from tests.unit.stub_test import TestRecursion
+from spotflow.api import SpotFlow
+from spotflow import static_analysis
+from spotflow.static_analysis import FileAnalysis, AnalysisCache, analyze_file, html_lines_for_code, store_lines
+
+SOURCE = '''
+class Foo(Base):
+
+    def __init__(self):
+        super().__init__()
+
+    def bar(self, x):
+        return_value = x
+        if x > 0:
+            return (x +
+                    1)
+        elif x < 0:
+            raise ValueError('negative')
+        while x:
+            x -= 1
+        for i in range(10):
+            pass
+        if x: return x
+        return return_value
+
+    def gen(self):
+        value = yield 1
+        yield from [value]
+'''
+
+DOCSTRING_SOURCE = '''
+@decorator
+def foo(a,
+        b):
+
+    """Docstring
+    of foo"""
+    return a
+
+def bar(): "Docstring of bar"
+'''
+
+
+class TestStaticAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        self.analysis = FileAnalysis('foo.py').analyze(SOURCE)
+
+    def test_return_lines(self):
+        self.assertEqual(self.analysis.return_lines, {10, 11, 18, 19})
+
+    def test_yield_lines(self):
+        self.assertEqual(self.analysis.yield_lines, {22, 23})
+
+    def test_control_flow_lines(self):
+        self.assertEqual(self.analysis.control_flow_lines, {9, 12, 14, 16, 18})
+
+    def test_raise_lines(self):
+        self.assertEqual(self.analysis.raise_lines, {13})
+
+    def test_raise_names(self):
+        self.assertEqual(self.analysis.raise_names, {13: 'ValueError'})
+
+    def test_super_call_lines(self):
+        self.assertEqual(self.analysis.super_call_lines, {5})
+
+    def test_definition_bodies(self):
+        self.assertEqual(self.analysis.definition_bodies, {2: 4, 4: 5, 7: 8, 21: 22})
+
+    def test_docstring_lines(self):
+        analysis = FileAnalysis('foo.py').analyze(DOCSTRING_SOURCE)
+        self.assertEqual(analysis.definition_bodies, {2: 6, 10: 10})
+        self.assertEqual(analysis.docstring_lines, {6, 7, 10})
+
+    def test_invalid_source(self):
+        analysis = FileAnalysis('foo.py').analyze('def foo(:')
+        self.assertEqual(analysis.return_lines, set())
+
+    def test_analyze_file_is_cached(self):
+        filename = tests.unit.stub_sut.__file__
+        analysis = analyze_file(filename)
+        self.assertIs(analyze_file(filename), analysis)
+        self.assertIn(609, analysis.return_lines)
+
+    def test_store_lines(self):
+        def func(a):
+            b = a
+            for i in range(a):
+                b += i
+            del a
+            return b
+
+        first_line = func.__code__.co_firstlineno
+        lines = {lineno - first_line: names for lineno, names in store_lines(func.__code__).items()}
+        self.assertEqual(lines, {1: ('b',), 2: ('i',), 3: ('b',), 4: ('a',)})
+
+
+class TestAnalysisCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'foo.py')
+        with open(self.filename, 'w') as f:
+            f.write(SOURCE)
+        self.cache = AnalysisCache(os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        static_analysis.use_analysis_cache(None)
+        static_analysis.file_analysis_cache.pop(self.filename, None)
+        shutil.rmtree(self.directory)
+
+    def test_unchanged_file(self):
+        self.assertIsNone(self.cache.load_analysis(self.filename))
+        self.cache.save_analysis(self.filename, FileAnalysis(self.filename).analyze(SOURCE))
+
+        analysis = self.cache.load_analysis(self.filename)
+        self.assertEqual(analysis.return_lines, {10, 11, 18, 19})
+
+        # Only touched, the content hash is the same
+        stat = os.stat(self.filename)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNotNone(self.cache.load_analysis(self.filename))
+
+    def test_invalid_entry(self):
+        self.cache.save(os.path.abspath(self.filename), {'analysis': 'not an analysis'})
+        self.assertIsNone(self.cache.load_analysis(self.filename))
+
+    def test_changed_file(self):
+        self.cache.save_analysis(self.filename, FileAnalysis(self.filename).analyze(SOURCE))
+        with open(self.filename, 'w') as f:
+            f.write(SOURCE.replace('return_value', 'other_value'))
+        self.assertIsNone(self.cache.load_analysis(self.filename))
+
+    def test_analyze_file_with_cache(self):
+        static_analysis.use_analysis_cache(self.cache)
+        analysis = analyze_file(self.filename)
+        self.assertIn(8, analysis.executable_lines)
+
+        # Later runs read the analysis from the cache
+        static_analysis.file_analysis_cache.pop(self.filename)
+        cached_analysis = analyze_file(self.filename)
+        self.assertIsNot(cached_analysis, analysis)
+        self.assertEqual(cached_analysis.executable_lines, analysis.executable_lines)
+        self.assertEqual(cached_analysis.definition_bodies, analysis.definition_bodies)
+
+        code = 'def foo():\n    return 1\n'
+        self.assertEqual(html_lines_for_code(code), html_lines_for_code(code))
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+    def test_cache_of_flow(self):
+        flow = SpotFlow()
+        flow.target_methods(['tests.unit.stub_sut'])
+        flow.analysis_cache(self.cache.directory)
+        static_analysis.file_analysis_cache.pop(tests.unit.stub_sut.__file__, None)
+
+        flow.start()
+        self.assertIs(static_analysis.analysis_cache, flow.cache)
+        TestRecursion().test_basic_recursion()
+        flow.stop()
+
+        # Other flows of the process do not use it
+        self.assertIsNone(static_analysis.analysis_cache)
+        self.assertTrue(os.listdir(self.cache.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
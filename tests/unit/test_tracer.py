@@ -0,0 +1,149 @@
+import sys
+import unittest
+from tests.unit.stub_test import TestSimpleCall, TestComplexCall, TestChangeState, TestReturnValue, \
+    TestExceptions, TestGenerator, TestGeneratorExpression, TestSuper, TestRecursion
+from spotflow.api import SpotFlow
+from spotflow.collector import Collector
+from spotflow.tracer import PyTracer, MonitoringTracer, ProfileTracer
+
+
+def monitor_with_tracer(func, target_methods, tracer):
+    flow = SpotFlow()
+    flow.target_methods(target_methods)
+    flow.tracer(tracer)
+
+    flow.start()
+    func()
+    flow.stop()
+
+    return flow.result()
+
+
+def summary(monitored_program):
+    methods = []
+    for method in monitored_program:
+        calls = []
+        for call in method.calls:
+            state = call.call_state
+            calls.append((call.call_stack, call.run_lines,
+                          [str(arg) for arg in state.arg_states],
+                          str(state.return_state),
+                          [str(each) for each in state.yield_states],
+                          str(state.exception_state),
+                          [str(state.var_states[var]) for var in state.var_states]))
+        methods.append((method.full_name, calls, len(method.flows)))
+    return methods
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_default_tracer(self):
+        collector = Collector()
+        self.assertIsInstance(collector.build_tracer(), PyTracer)
+
+    def test_no_local_trace_for_non_target_frames(self):
+        collector = Collector()
+        collector.method_names = ['tests.unit.stub_sut']
+        collector.init_target()
+        tracer = PyTracer(collector)
+
+        frame = sys._getframe()
+        self.assertIsNone(tracer._global_trace(frame, 'call', None))
+        self.assertIsNone(collector.target_codes_cache[frame.f_code])
+
+    def test_local_trace_for_target_frames(self):
+        collector = Collector()
+        collector.method_names = ['tests.unit.test_tracer']
+        collector.init_target()
+        tracer = PyTracer(collector)
+
+        frame = sys._getframe()
+        self.assertEqual(tracer._global_trace(frame, 'call', None), tracer._local_trace)
+        self.assertEqual(collector.target_codes_cache[frame.f_code].name, frame.f_code.co_name)
+
+    @unittest.skipIf(sys.version_info >= (3, 12), 'sys.monitoring is available')
+    def test_monitoring_fallback(self):
+        collector = Collector()
+        collector.tracer = 'monitoring'
+        self.assertIsInstance(collector.build_tracer(), PyTracer)
+
+    @unittest.skipUnless(sys.version_info >= (3, 12), 'requires sys.monitoring')
+    def test_monitoring_tracer(self):
+        collector = Collector()
+        collector.tracer = 'monitoring'
+        self.assertIsInstance(collector.build_tracer(), MonitoringTracer)
+
+    @unittest.skipUnless(sys.version_info >= (3, 12), 'requires sys.monitoring')
+    def test_same_result_as_settrace(self):
+        test_classes = [TestSimpleCall, TestComplexCall, TestChangeState, TestReturnValue,
+                        TestExceptions, TestGenerator, TestGeneratorExpression, TestSuper, TestRecursion]
+
+        for test_class in test_classes:
+            for name in dir(test_class):
+                if name.startswith('test_'):
+                    func = getattr(test_class(), name)
+                    with self.subTest(test=f'{test_class.__name__}.{name}'):
+                        expected = monitor_with_tracer(func, ['tests.unit.stub_sut'], 'settrace')
+                        actual = monitor_with_tracer(func, ['tests.unit.stub_sut'], 'monitoring')
+                        self.assertEqual(summary(actual), summary(expected))
+
+    @unittest.skipUnless(sys.version_info >= (3, 12), 'requires sys.monitoring')
+    def test_monitoring_only_enables_target_codes(self):
+        method_name = 'tests.unit.stub_sut.Recursion.basic_recursion'
+        flow = SpotFlow()
+        flow.target_methods([method_name])
+        flow.tracer('monitoring')
+
+        flow.start()
+        tracer = flow.collector.py_tracer
+        TestRecursion().test_basic_recursion()
+        target_codes = set(tracer.target_codes)
+        flow.stop()
+
+        self.assertEqual([code.co_name for code in target_codes], ['basic_recursion'])
+        self.assertEqual(len(flow.result()[method_name].calls), 3)
+
+    def test_profile_tracer(self):
+        collector = Collector()
+        collector.tracer = 'setprofile'
+        self.assertIsInstance(collector.build_tracer(), ProfileTracer)
+
+    def test_profile_tracer_collects_calls(self):
+        expected = monitor_with_tracer(TestRecursion().test_basic_recursion, ['tests.unit.stub_sut'], 'settrace')
+        actual = monitor_with_tracer(TestRecursion().test_basic_recursion, ['tests.unit.stub_sut'], 'setprofile')
+
+        method_name = 'tests.unit.stub_sut.Recursion.basic_recursion'
+        expected_calls = expected[method_name].calls
+        actual_calls = actual[method_name].calls
+        self.assertEqual([call.call_stack for call in actual_calls], [call.call_stack for call in expected_calls])
+        self.assertEqual([str(call.call_state.return_state) for call in actual_calls],
+                         [str(call.call_state.return_state) for call in expected_calls])
+
+        # Lines are not traced
+        self.assertEqual([call.run_lines for call in actual_calls], [[], [], []])
+        self.assertEqual(len(actual[method_name].flows), 0)
+        self.assertEqual(actual[method_name].info.coverage_ratio, 'NA')
+
+    def test_profile_tracer_exceptions(self):
+        monitored_program = monitor_with_tracer(TestExceptions().test_raise_specific_exception,
+                                                ['tests.unit.stub_sut'], 'setprofile')
+        call = monitored_program['tests.unit.stub_sut.Exceptions.raise_specific_exception'].calls[0]
+        self.assertEqual(call.call_state.exception_state.value, 'TypeError')
+
+        # Exceptions raised by callees propagate to the target callers
+        monitored_program = monitor_with_tracer(TestExceptions().test_raise_exception_line_1,
+                                                ['tests.unit.stub_sut'], 'setprofile')
+        raise_here = monitored_program['tests.unit.stub_sut.Exceptions.raise_here'].calls[0]
+        caller = monitored_program['tests.unit.stub_sut.Exceptions.raise_distinct_exception'].calls[0]
+        self.assertEqual(raise_here.call_state.exception_state.value, 'Exception')
+        self.assertEqual(caller.call_state.exception_state.value, 'Exception')
+
+        # Exceptions raised by builtins are unknown
+        monitored_program = monitor_with_tracer(TestExceptions().test_zero_division, ['tests.unit.stub_sut'],
+                                                'setprofile')
+        call = monitored_program['tests.unit.stub_sut.Exceptions.zero_division'].calls[0]
+        self.assertIsNone(call.call_state.exception_state)
+
+
+if __name__ == '__main__':
+    unittest.main()
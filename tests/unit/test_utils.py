@@ -42,6 +42,21 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(obj_value(Calculator(100).add(1)), 'None')
         self.assertEqual(obj_value(Calculator(100).total), '100')
 
+    def test_may_change_in_place(self):
+        self.assertFalse(may_change_in_place(1))
+        self.assertFalse(may_change_in_place((1, 'a', None)))
+        self.assertFalse(may_change_in_place(frozenset({1, 2})))
+        self.assertTrue(may_change_in_place([1]))
+        self.assertTrue(may_change_in_place((1, [2])))
+        self.assertTrue(may_change_in_place(((1, 2), 3)))
+        self.assertTrue(may_change_in_place(tuple(range(1000))))
+
+        # Deeply nested tuples are not walked
+        nested = ()
+        for _ in range(100000):
+            nested = (nested,)
+        self.assertTrue(may_change_in_place(nested))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file